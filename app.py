@@ -1,19 +1,56 @@
 from flask import Flask, request, Response
 from twilio.twiml.messaging_response import MessagingResponse
-from context_gatherer import gather_context
-import requests
+from context_gatherer import gather_sources, format_context
+from context_compactor import compact_sources
+from cache import cache, normalize_key
+from delivery import DeliveryPool, TwilioRestSender
+from streaming import iter_in_background, iter_sse_deltas, iter_section_lines
+from singleflight import SingleFlight, FlightCancelled
+from ratelimit import Admission, RateLimited, get_limiter
+from telemetry import (
+    EMPTY_REPLIES, REQUESTS, TRUNCATIONS, UPSTREAM_ERRORS, Gauge,
+    log_event, observe_stage, register, render_metrics, sampled, span, trace_request,
+)
+import context_gatherer
+import http_client
+import logging
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
 app = Flask(__name__)
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-
-
-def generate_script(user_idea):
-    context = gather_context(user_idea)
-
+GROQ_API_URL = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+# Generated scripts embed Brave/Reddit context, so they go stale on the same scale
+SCRIPT_CACHE_TTL = float(os.getenv("SCRIPT_CACHE_TTL", "600"))
+# Scripts built while some context sources were unavailable are kept only briefly (0 = not cached)
+PARTIAL_SCRIPT_CACHE_TTL = float(os.getenv("PARTIAL_SCRIPT_CACHE_TTL", "60"))
+# Acknowledge the webhook immediately and send scripts from a worker pool
+ASYNC_REPLIES = os.getenv("ASYNC_REPLIES", "").lower() in ("1", "true", "yes")
+# Sender number for outbound messages; defaults to the number the user wrote to
+TWILIO_WHATSAPP_FROM = os.getenv("TWILIO_WHATSAPP_FROM")
+# How long a duplicate request waits for an identical in-flight generation
+COALESCE_TIMEOUT = float(os.getenv("COALESCE_TIMEOUT", "30"))
+# Time a sync webhook may spend before answering; Twilio gives up after 15 s
+WEBHOOK_BUDGET = float(os.getenv("WEBHOOK_BUDGET", "12"))
+# How long a request may wait for a Groq rate-limit slot before it is shed
+GROQ_QUEUE_TIMEOUT = float(os.getenv("GROQ_QUEUE_TIMEOUT", "3"))
+
+RATE_LIMITED_REPLY = "⚠️ Our AI provider is rate-limiting us right now. Please try again in a minute."
+GENERATION_FAILED_REPLY = "⚠️ Couldn't generate content. Please try again."
+NO_SCRIPT_REPLY = "⚠️ Unable to generate or deliver script. Try again with a simpler topic."
+REJECTED_REPLIES = {
+    "sender_busy": "⏳ I'm still working on your earlier ideas. Send this one again once those arrive.",
+    "overloaded": "⚠️ We're handling a lot of requests right now. Please try again in a minute.",
+}
+
+script_flights = SingleFlight()
+admission = Admission()
+
+
+def build_prompt(user_idea, context):
     prompt = f"""
 You are a niche content strategist for advanced creators on platforms like Instagram and X (Twitter).
 
@@ -38,94 +75,413 @@ Generate:
 
 Write for creators who are building a niche by showing original thinking, not chasing trends.
 """
+    return prompt
+
+
+def _stream_completion(user_idea, missing=None):
+    # missing, if given, is filled with the context sources that couldn't be gathered
+    with span("context"):
+        results, unavailable = gather_sources(user_idea)
+    if missing is not None:
+        missing.update(unavailable)
+    with span("compaction"):
+        results, stats = compact_sources(user_idea, results)
+    if stats["tokens_saved"]:
+        TRUNCATIONS.inc("context")
+    log_event("context_compacted", **stats)
+    with span("prompt_build"):
+        prompt = build_prompt(user_idea, format_context(results, unavailable))
+
+    if sampled():
+        log_event("groq_prompt", prompt=prompt)
+
+    # The Groq slot is held only while the upstream streams, not while the consumer
+    # (e.g. Twilio delivery in async mode) works through the deltas
+    yield from iter_in_background(lambda: _groq_deltas(prompt))
+
+
+def _groq_deltas(prompt):
+    queued = time.perf_counter()
+    first = True
+    try:
+        with get_limiter("groq").slot(GROQ_QUEUE_TIMEOUT) as slot:
+            # TTFT and total are timed from the send: waiting for a local slot isn't upstream latency
+            start = time.perf_counter()
+            observe_stage("llm_queue", start - queued)
+            with http_client.post(
+                "groq",
+                GROQ_API_URL,
+                headers={
+                    "Authorization": f"Bearer {GROQ_API_KEY}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "model": "llama-3.3-70b-versatile",
+                    "messages": [{"role": "user", "content": prompt}],
+                    "temperature": 0.8,
+                    "stream": True
+                },
+                stream=True
+            ) as response:
+                if response.status_code != 200:
+                    log_event("groq_error", logging.WARNING, status=response.status_code, body=response.text[:500])
+                response.raise_for_status()
+                for delta in iter_sse_deltas(response.iter_lines()):
+                    if first:
+                        ttft = time.perf_counter() - start
+                        observe_stage("llm_ttft", ttft)
+                        slot.mark_latency(ttft)
+                        first = False
+                    yield delta
+    except RateLimited:
+        UPSTREAM_ERRORS.inc("groq", "rate_limited")
+        raise
+    except Exception:
+        UPSTREAM_ERRORS.inc("groq", "error")
+        raise
+    observe_stage("llm_total", time.perf_counter() - start)
+
+
+def _generate_script(user_idea, key):
+    reply_text = "".join(_lead_generation(user_idea, key))
+    if not reply_text.strip():
+        raise ValueError("empty completion")  # don't cache empty replies
+    return reply_text
+
+
+def stream_script(user_idea, deadline=None):
+    # deadline is a time.monotonic() value that bounds how long this caller waits on another's generation
+    key = normalize_key(user_idea)
+    # The refresh caches its own result, with a TTL that depends on the context it had
+    refresh = lambda: script_flights.do(key, lambda: _generate_script(user_idea, key))
+    cached = cache.peek("script", key, refresh)
+    if cached is not None:
+        yield cached
+        return
+
+    # Identical ideas arriving together share one context fan-out and one completion
+    while True:
+        call, leader = script_flights.begin(key)
+        if leader:
+            break
+        timeout = COALESCE_TIMEOUT
+        if deadline is not None:
+            timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+        try:
+            result = script_flights.wait(call, timeout)
+        except FlightCancelled:
+            continue
+        log_event("generation_coalesced", key=key)
+        yield result
+        return
+
+    # Every exit from here ends the flight, or later requests for this key would wait on it forever
+    try:
+        reply_text = yield from _lead_generation(user_idea, key)
+    except Exception as e:
+        script_flights.finish(key, call, error=e)
+        raise
+    except BaseException:
+        script_flights.cancel(key, call)
+        raise
+    script_flights.finish(key, call, result=reply_text)
+
+
+def _lead_generation(user_idea, key):
+    cached = cache.get("script", key)  # a flight may have finished since peek()
+    if cached is not None:
+        yield cached
+        return cached
+
+    parts, missing = [], {}
+    for delta in _stream_completion(user_idea, missing):
+        parts.append(delta)
+        yield delta
+
+    reply_text = "".join(parts)
+    if sampled():
+        log_event("groq_reply", chars=len(reply_text), preview=reply_text[:300])
+    # A transient Brave or Reddit failure shouldn't stick to the idea for SCRIPT_CACHE_TTL
+    ttl = PARTIAL_SCRIPT_CACHE_TTL if missing else SCRIPT_CACHE_TTL
+    if reply_text.strip() and ttl:
+        try:
+            cache.set("script", key, reply_text, ttl)
+        except Exception as e:
+            # The reply is already out; a failed cache write only costs a regeneration next time
+            log_event("cache_write_failed", logging.WARNING, key=key, error=str(e))
+    return reply_text
 
-    print("🔁 Sending to Groq with prompt:")
-    print(prompt)
-    print("📬 Waiting for response...")
 
+def generate_script(user_idea):
     try:
-        response = requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {GROQ_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "llama-3.3-70b-versatile",
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.8
-            },
-            timeout=6
-        )
-
-        print("✅ Groq status code:", response.status_code)
-        print("🧠 Raw response text:", response.text)
-
-        data = response.json()
-        reply_text = data["choices"][0]["message"]["content"]
-        reply_text = reply_text[:1500]  # limit to prevent WhatsApp cutoff
-        print("📝 Final reply (start):", reply_text[:300])
-        return reply_text
+        return "".join(stream_script(user_idea))
+    except RateLimited as e:
+        log_event("generation_rate_limited", logging.WARNING, error=str(e))
+        return RATE_LIMITED_REPLY
+    except Exception as e:
+        log_event("generation_failed", logging.ERROR, error=str(e))
+        return GENERATION_FAILED_REPLY
+
 
+def split_message(text, max_length=1500):
+    lines = text.split("\n")
+    chunks = []
+    chunk = ""
+
+    for line in lines:
+        if len(chunk) + len(line) + 1 > max_length:
+            chunks.append(chunk.strip())
+            chunk = line
+        else:
+            chunk += "\n" + line if chunk else line
+    if chunk:
+        chunks.append(chunk.strip())
+    return chunks
+
+
+def sanitize(text):
+    text = text.replace("**", "").replace("*", "")
+    text = text.replace("```", "").replace("__", "")
+    return text.encode("ascii", "ignore").decode()
+
+
+def classify_section(text):
+    if "Instagram" in text:
+        return "insta"
+    elif "Twitter" in text or "X" in text:
+        return "x"
+    return None
+
+
+SECTION_LABELS = {
+    "insta": ("Insta", "📸 *Instagram Reel (Part {n}):*\n\n{part}"),
+    "x": ("X", "🐦 *X Thread (Part {n}):*\n\n{part}"),
+}
+
+
+class SectionChunker:
+    # Incremental split_message() for one "### " section: a chunk is emitted as soon as the
+    # next line would overflow it, instead of after the whole completion has arrived.
+    # claimed holds the platforms already answered; like the original one-section-per-platform
+    # reply, a later section for the same platform is dropped rather than numbered from Part 1 again
+    def __init__(self, number, max_length=1500, claimed=None):
+        self.number = number
+        self.max_length = max_length
+        self.claimed = set() if claimed is None else claimed
+        self.kind = None
+        self.skipped = False
+        self.pending = []
+        self.chunk = ""
+        self.started = False
+        self.parts = 0
+
+    def add(self, line):
+        line = sanitize(line)
+        if self.skipped:
+            return []
+        if self.kind is not None:
+            return self._feed(line)
+
+        self.pending.append(line)
+        header = next((l for l in self.pending if l.strip()), None)
+        # The preamble before the first heading only counts if the model used no headings
+        if self.number == 0 or header is None:
+            return []
+        if not self._classify(header):
+            return []  # classify on the full text in finish(), or a repeat of a sent platform
+        return self._drain()
+
+    def finish(self):
+        messages = []
+        if self.skipped:
+            return []
+        if self.kind is None:
+            if not self._classify("\n".join(self.pending)):
+                return []
+            messages = self._drain()
+        return messages + self._emit(self.chunk.strip())
+
+    def _classify(self, text):
+        kind = classify_section(text)
+        if kind is None:
+            return False
+        if kind in self.claimed:
+            self.skipped = True
+            self.pending = []
+            log_event("reply_section_skipped", logging.DEBUG, section=SECTION_LABELS[kind][0], number=self.number)
+            return False
+        self.kind = kind
+        self.claimed.add(kind)
+        return True
+
+    def _drain(self):
+        messages = []
+        pending, self.pending = self.pending, []
+        for line in pending:
+            messages += self._feed(line)
+        return messages
+
+    def _feed(self, line):
+        if not self.started:
+            if not line.strip():
+                return []  # leading blank lines are stripped, as in section.strip()
+            line = line.lstrip()
+            self.started = True
+
+        if len(self.chunk) + len(line) + 1 > self.max_length:
+            messages = self._emit(self.chunk.strip())
+            self.chunk = line
+            return messages
+        self.chunk += "\n" + line if self.chunk else line
+        return []
+
+    def _emit(self, part):
+        if not part:
+            return []
+        self.parts += 1
+        if self.parts == 2:
+            TRUNCATIONS.inc("message")
+        name, template = SECTION_LABELS[self.kind]
+        log_event("reply_part", logging.DEBUG, section=name, part=self.parts, chars=len(part))
+        return [template.format(n=self.parts, part=part)]
+
+
+def stream_messages(deltas, max_length=1500):
+    section = None
+    claimed = set()  # one section per platform
+    busy = 0.0
+    for number, line in iter_section_lines(deltas):
+        start = time.perf_counter()
+        messages = []
+        if section is None or number != section.number:
+            if section is not None and section.number > 0:
+                messages += section.finish()
+            section = SectionChunker(number, max_length, claimed)
+        messages += section.add(line)
+        busy += time.perf_counter() - start
+        yield from messages
+
+    if section is not None:
+        yield from section.finish()
+    observe_stage("postprocess", busy)
+
+
+def _safe_deltas(user_idea, errors, deadline=None):
+    try:
+        yield from stream_script(user_idea, deadline)
+    except RateLimited as e:
+        errors.append(e)
+        log_event("generation_rate_limited", logging.WARNING, error=str(e))
     except Exception as e:
-        print("❌ Error from Groq:", str(e), flush=True)
-        return "⚠️ Couldn't generate content. Please try again."
+        errors.append(e)
+        log_event("generation_failed", logging.ERROR, error=str(e))
+
+
+def reply_messages(user_idea, deadline=None):
+    # Each finished section part is yielded as soon as the stream has produced it
+    errors = []
+    sent = False
+    for message in stream_messages(_safe_deltas(user_idea, errors, deadline)):
+        sent = True
+        yield message
+
+    if not sent:
+        EMPTY_REPLIES.inc()
+        if any(isinstance(e, RateLimited) for e in errors):
+            yield RATE_LIMITED_REPLY
+        else:
+            yield NO_SCRIPT_REPLY
+
+
+def deliver_script(job):
+    with trace_request("delivery", force=job.get("trace", False), sender=job["to"]):
+        yield from reply_messages(job["body"])
+
+
+delivery_pool = DeliveryPool(deliver_script, TwilioRestSender())
+
+
+def _flight_stats(name, flights):
+    return [((name, outcome), count) for outcome, count in flights.stats().items() if outcome != "in_flight"]
+
+
+def _pool_stats(field):
+    return [
+        ((upstream, host), counts[field])
+        for upstream, hosts in http_client.pool_stats().items()
+        for host, counts in hosts.items()
+    ]
+
+
+register(Gauge(
+    "bot_cache_lookups_total", "Cache lookups by namespace and result.", ("namespace", "result"),
+    lambda: [((namespace, result), count) for namespace, counts in cache.stats().items() for result, count in counts.items()],
+    kind="counter",
+))
+register(Gauge(
+    "bot_singleflight_calls_total", "Single-flight calls by outcome; 'coalesced' shared another call.", ("flight", "outcome"),
+    lambda: _flight_stats("script", script_flights) + _flight_stats("source", context_gatherer.source_flights),
+    kind="counter",
+))
+register(Gauge(
+    "bot_http_connections_opened_total", "Upstream connections opened.", ("upstream", "host"),
+    lambda: _pool_stats("opened"), kind="counter",
+))
+register(Gauge(
+    "bot_http_connections_reused_total", "Upstream requests served on a kept-alive connection.", ("upstream", "host"),
+    lambda: _pool_stats("reused"), kind="counter",
+))
+register(Gauge(
+    "bot_http_connections_discarded_total", "Upstream connections closed because the keep-alive pool was full.",
+    ("upstream", "host"), lambda: _pool_stats("discarded"), kind="counter",
+))
+register(Gauge("bot_delivery_queue_depth", "Jobs waiting for a delivery worker.", (), lambda: [((), delivery_pool.depth())]))
+register(Gauge("bot_delivery_dead_letters", "Messages that could not be delivered.", (), lambda: [((), len(delivery_pool.dead_letters))]))
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/whatsapp", methods=["POST"])
 def whatsapp():
+    deadline = time.monotonic() + WEBHOOK_BUDGET
     incoming_msg = request.form.get("Body")
-    print(f"📩 Received: {incoming_msg}", flush=True)
-
-    reply = generate_script(incoming_msg)
-
-    if not reply or len(reply.strip()) == 0:
-        reply = "⚠️ I couldn’t generate a response. Try again in a few seconds."
-
-    reply = reply.replace("**", "").replace("*", "")
-    reply = reply.replace("```", "").replace("__", "")
-    reply = reply.encode("ascii", "ignore").decode()
-
-    sections = reply.split("### ")
-    insta, x_post = "", ""
-    for section in sections:
-        if "Instagram" in section:
-            insta = section.strip()
-        elif "Twitter" in section or "X" in section:
-            x_post = section.strip()
-
-    def split_message(text, max_length=1500):
-        lines = text.split("\n")
-        chunks = []
-        chunk = ""
-
-        for line in lines:
-            if len(chunk) + len(line) + 1 > max_length:
-                chunks.append(chunk.strip())
-                chunk = line
-            else:
-                chunk += "\n" + line if chunk else line
-        if chunk:
-            chunks.append(chunk.strip())
-        return chunks
+    sender = request.form.get("From")
+    # Opt-in trace dump for one request: ?trace=1 on the webhook URL or an X-Debug-Trace header
+    force_trace = request.args.get("trace") == "1" or request.headers.get("X-Debug-Trace") == "1"
+    log_event("message_received", sender=sender, body=incoming_msg)
 
     resp = MessagingResponse()
-    if insta:
-        for i, part in enumerate(split_message(insta)):
-            print(f"📤 Sending Insta part {i+1}: {len(part)} chars")
-            resp.message(f"📸 *Instagram Reel (Part {i+1}):*\n\n{part}")
-    if x_post:
-        for i, part in enumerate(split_message(x_post)):
-            print(f"📤 Sending X part {i+1}: {len(part)} chars")
-            resp.message(f"🐦 *X Thread (Part {i+1}):*\n\n{part}")
-
-    if not insta and not x_post:
-        resp.message("⚠️ Unable to generate or deliver script. Try again with a simpler topic.")
-
-    print("📤 WhatsApp message(s) sent.")
-    return Response(str(resp), mimetype="application/xml")
+    if ASYNC_REPLIES:
+        REQUESTS.inc("async")
+        job = {
+            "body": incoming_msg,
+            "to": sender,
+            "from": TWILIO_WHATSAPP_FROM or request.form.get("To"),
+            "trace": force_trace,
+        }
+        status = delivery_pool.submit(job)
+        if status != "queued":
+            resp.message(REJECTED_REPLIES[status])
+        # Scripts are sent from the worker pool through the REST API
+        return Response(str(resp), mimetype="application/xml")
+
+    REQUESTS.inc("sync")
+    # Cached ideas are answered without Groq, so a Groq cooldown doesn't shed them
+    needs_groq = not cache.servable("script", normalize_key(incoming_msg))
+    with admission.admit(sender, needs_groq) as rejected, trace_request("whatsapp", force=force_trace, sender=sender):
+        # Shed right away rather than queue past Twilio's webhook deadline
+        messages = [REJECTED_REPLIES[rejected]] if rejected else list(reply_messages(incoming_msg, deadline))
+        with span("twiml_build"):
+            for message in messages:
+                resp.message(message)
+            body = str(resp)
+
+    log_event("reply_sent", sender=sender, parts=len(messages))
+    return Response(body, mimetype="application/xml")
 
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
-
@@ -0,0 +1,256 @@
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SCRIPT_TEXT = (
+    "Here are your scripts.\n\n"
+    "### 1. Instagram Reel Script\n\n"
+    + "\n".join(f"Beat {i}: a sharp, specific claim about the topic with a concrete number." for i in range(12))
+    + "\n\n### 2. Twitter (X) Thread\n\n"
+    + "\n".join(f"{i}/ A counterpoint that the Reel didn't cover, kept under 280 characters." for i in range(1, 4))
+    + "\n"
+)
+# Tagged into the script when the prompt says a context source was unavailable, so the
+# load test can count replies built on missing context
+PARTIAL_CONTEXT_MARKER = "[bench: partial context]"
+
+
+class Profile:
+    # Latency is lognormal around median_ms; streaming responses add chunk_delay_ms per chunk
+    def __init__(self, median_ms=100, sigma=0.3, error_rate=0.0, error_status=500,
+                 stream_chunks=24, chunk_delay_ms=15):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stream_chunks = stream_chunks
+        self.chunk_delay_ms = chunk_delay_ms
+
+    def latency(self):
+        return self.median_ms * random.lognormvariate(0, self.sigma) / 1000 if self.median_ms else 0.0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Pooled clients drop idle keep-alive connections; that's not a failure
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeUpstream:
+    def __init__(self, name, profile=None):
+        self.name = name
+        self.profile = profile or Profile()
+        self.routes = []  # (method, compiled path regex, handler)
+        self.service_times = []
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", 0), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def route(self, method, pattern, handler):
+        self.routes.append((method, re.compile(pattern + "$"), handler))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"fake-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_stats(self):
+        with self._lock:
+            self.service_times = []
+            self.errors = 0
+
+    def _record(self, seconds, error=False):
+        with self._lock:
+            self.service_times.append(seconds)
+            self.errors += int(error)
+
+    def _handler_class(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def _dispatch(self, method):
+                start = time.perf_counter()
+                parsed = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                for route_method, pattern, handler in upstream.routes:
+                    match = pattern.match(parsed.path)
+                    if route_method == method and match:
+                        break
+                else:
+                    self.send_json(404, {"error": "not found"})
+                    return
+
+                time.sleep(upstream.profile.latency())
+                if random.random() < upstream.profile.error_rate:
+                    self.send_json(upstream.profile.error_status, {"error": "injected failure"})
+                    upstream._record(time.perf_counter() - start, error=True)
+                    return
+                handler(upstream, self, match, parse_qs(parsed.query), body)
+                upstream._record(time.perf_counter() - start)
+
+            def send_json(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_chunked(self, content_type, chunks, delay):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for chunk in chunks:
+                    time.sleep(delay)
+                    data = chunk.encode()
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+
+def _groq_completion(upstream, handler, match, query, body):
+    request = json.loads(body or b"{}")
+    profile = upstream.profile
+    prompt = "".join(message.get("content", "") for message in request.get("messages", []))
+    text = SCRIPT_TEXT
+    if "[Unavailable:" in prompt:
+        text = text.replace("Script\n\n", f"Script\n\n{PARTIAL_CONTEXT_MARKER}\n", 1)
+    if not request.get("stream"):
+        handler.send_json(200, {"choices": [{"index": 0, "message": {"role": "assistant", "content": text}}]})
+        return
+
+    size = max(1, len(text) // max(1, profile.stream_chunks))
+    pieces = [text[i:i + size] for i in range(0, len(text), size)]
+    events = [
+        "data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": piece}}]}) + "\n\n"
+        for piece in pieces
+    ]
+    events.append("data: [DONE]\n\n")
+    handler.send_chunked("text/event-stream", events, profile.chunk_delay_ms / 1000)
+
+
+def _wikipedia_summary(upstream, handler, match, query, body):
+    topic = match.group(1).replace("_", " ")
+    extract = " ".join(
+        f"{topic.capitalize()} fact {i} describes a specific, checkable detail about the subject." for i in range(20)
+    )
+    handler.send_json(200, {"title": topic, "extract": extract})
+
+
+def _brave_search(upstream, handler, match, query, body):
+    topic = query.get("q", [""])[0]
+    count = int(query.get("count", ["3"])[0])
+    results = [
+        {"title": f"{topic} result {i}", "description": f"News snippet {i} about {topic}.", "url": f"https://example.com/{i}"}
+        for i in range(count)
+    ]
+    handler.send_json(200, {"web": {"results": results}})
+
+
+def _reddit_token(upstream, handler, match, query, body):
+    handler.send_json(200, {"access_token": "bench-token", "token_type": "bearer", "expires_in": 86400, "scope": "*"})
+
+
+def _reddit_search(upstream, handler, match, query, body):
+    topic = query.get("q", [""])[0]
+    children = [
+        {"kind": "t3", "data": {
+            "id": f"bench{i}", "name": f"t3_bench{i}", "title": f"Thoughts on {topic} #{i}",
+            "score": 100 - i, "num_comments": 10 + i, "stickied": False,
+            "subreddit": "all", "author": "bench_user", "permalink": f"/r/all/comments/bench{i}/",
+        }}
+        for i in range(int(query.get("limit", ["3"])[0]))
+    ]
+    handler.send_json(200, {"kind": "Listing", "data": {"after": None, "before": None, "dist": len(children), "children": children}})
+
+
+class FakeTwilio(FakeUpstream):
+    def __init__(self, profile=None):
+        super().__init__("twilio", profile)
+        self.deliveries = {}  # To -> [(perf_counter timestamp, body)]
+        self.route("POST", r"/2010-04-01/Accounts/[^/]+/Messages\.json", self._create_message)
+
+    def reset_stats(self):
+        super().reset_stats()
+        with self._lock:
+            self.deliveries = {}
+
+    def _create_message(self, upstream, handler, match, query, body):
+        form = parse_qs(body.decode())
+        to = form.get("To", [""])[0]
+        with self._lock:
+            self.deliveries.setdefault(to, []).append((time.perf_counter(), form.get("Body", [""])[0]))
+        handler.send_json(201, {"sid": f"SM{uuid.uuid4().hex}", "status": "queued", "to": to})
+
+
+def start_fakes(profiles=None):
+    # Returns {name: FakeUpstream}; profiles maps upstream name -> Profile
+    profiles = profiles or {}
+    fakes = {name: FakeUpstream(name, profiles.get(name)) for name in ("groq", "brave", "wikipedia", "reddit")}
+    fakes["twilio"] = FakeTwilio(profiles.get("twilio"))
+
+    fakes["groq"].route("POST", r"/openai/v1/chat/completions", _groq_completion)
+    fakes["brave"].route("GET", r"/res/v1/web/search", _brave_search)
+    fakes["wikipedia"].route("GET", r"/api/rest_v1/page/summary/(.+)", _wikipedia_summary)
+    fakes["reddit"].route("POST", r"/api/v1/access_token", _reddit_token)
+    fakes["reddit"].route("GET", r"/r/[^/]+/search/?", _reddit_search)
+
+    for fake in fakes.values():
+        fake.start()
+    return fakes
+
+
+def app_environment(fakes):
+    # Environment overrides that point the app at the fakes
+    return {
+        "GROQ_API_URL": f"{fakes['groq'].url}/openai/v1/chat/completions",
+        "GROQ_API_KEY": "bench",
+        "BRAVE_API_URL": f"{fakes['brave'].url}/res/v1/web/search",
+        "BRAVE_API_KEY": "bench",
+        "WIKIPEDIA_API_URL": f"{fakes['wikipedia'].url}/api/rest_v1/page/summary",
+        "REDDIT_URL": fakes["reddit"].url,
+        "REDDIT_OAUTH_URL": fakes["reddit"].url,
+        "REDDIT_CLIENT_ID": "bench",
+        "REDDIT_CLIENT_SECRET": "bench",
+        "REDDIT_USER_AGENT": "idea-to-execution-bot-bench",
+        "praw_check_for_updates": "False",
+        "TWILIO_API_BASE": fakes["twilio"].url,
+        "TWILIO_ACCOUNT_SID": "ACbench",
+        "TWILIO_AUTH_TOKEN": "bench",
+    }
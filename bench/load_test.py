@@ -0,0 +1,319 @@
+# Offline load test for /whatsapp against local fake upstreams.
+#
+#   python -m bench.load_test --concurrency 1,8,32 --requests 64 --async-replies \
+#       --latency groq=400,brave=150 --error-rate brave=0.05 --output bench_results.json
+#
+# The app's rate limiters are configured here rather than from the caller's .env, and are
+# reset before every level so one level's backoff doesn't throttle the next.
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from xml.etree import ElementTree
+
+from bench.fake_upstreams import PARTIAL_CONTEXT_MARKER, Profile, app_environment, start_fakes
+
+UPSTREAMS = ("groq", "brave", "wikipedia", "reddit", "twilio")
+LIMITED_UPSTREAMS = ("groq", "brave", "wikipedia", "reddit")
+_BUCKET = re.compile(r'bot_stage_seconds_bucket\{stage="([^"]+)",le="([^"]+)"\} (\S+)')
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "p50_ms": round(rank(50) * 1000, 2),
+        "p95_ms": round(rank(95) * 1000, 2),
+        "p99_ms": round(rank(99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+def scrape_stage_buckets(session, url):
+    # {stage: {le: cumulative count}} from the app's /metrics histogram
+    buckets = {}
+    for stage, le, count in _BUCKET.findall(session.get(f"{url}/metrics", timeout=10).text):
+        buckets.setdefault(stage, {})[float(le)] = float(count)
+    return buckets
+
+
+def bucket_percentiles(before, after):
+    # Percentiles of one level's observations, resolved to histogram bucket upper bounds
+    stages = {}
+    for stage, counts in after.items():
+        previous = before.get(stage, {})
+        bounds = sorted(counts)
+        delta = [counts[le] - previous.get(le, 0) for le in bounds]
+        total = delta[-1] if delta else 0
+        if not total:
+            continue
+
+        def bound(p):
+            for le, cumulative in zip(bounds, delta):
+                if cumulative >= p / 100 * total:
+                    return le * 1000 if le != float("inf") else None
+            return None
+
+        stages[f"app.{stage}"] = {"count": int(total), "p50_ms_le": bound(50), "p95_ms_le": bound(95), "p99_ms_le": bound(99)}
+    return stages
+
+
+def twiml_messages(body):
+    return [message.text or "" for message in ElementTree.fromstring(body).iter("Message")]
+
+
+def classify(bot, messages):
+    # (outcome, reason): "ok", "degraded" (a fallback reply or a script built on missing
+    # context) or "shed" (refused before any work); None when nothing was delivered
+    if not messages:
+        return None, None
+    if any(message in bot.REJECTED_REPLIES.values() for message in messages):
+        return "shed", next(reason for reason, reply in bot.REJECTED_REPLIES.items() if reply in messages)
+    if bot.RATE_LIMITED_REPLY in messages:
+        return "degraded", "rate_limited"
+    if bot.GENERATION_FAILED_REPLY in messages or bot.NO_SCRIPT_REPLY in messages:
+        return "degraded", "generation_failed"
+    if any(PARTIAL_CONTEXT_MARKER in message for message in messages):
+        return "degraded", "partial_context"
+    return "ok", None
+
+
+def parse_overrides(value, cast=float):
+    # "groq=400,brave=150" -> {"groq": 400.0, "brave": 150.0}
+    overrides = {}
+    for item in filter(None, (value or "").split(",")):
+        name, _, number = item.partition("=")
+        if name not in UPSTREAMS:
+            raise SystemExit(f"Unknown upstream '{name}', expected one of {', '.join(UPSTREAMS)}")
+        overrides[name] = cast(number)
+    return overrides
+
+
+def build_profiles(args):
+    latency = parse_overrides(args.latency)
+    error_rate = parse_overrides(args.error_rate)
+    error_status = parse_overrides(args.error_status, int)
+    defaults = {"groq": 300, "brave": 120, "wikipedia": 80, "reddit": 150, "twilio": 60}
+    return {
+        name: Profile(
+            median_ms=latency.get(name, defaults[name]),
+            sigma=args.sigma,
+            error_rate=error_rate.get(name, 0.0),
+            error_status=error_status.get(name, 500),
+            stream_chunks=args.stream_chunks,
+            chunk_delay_ms=args.chunk_delay,
+        )
+        for name in UPSTREAMS
+    }
+
+
+def build_limits(args):
+    # Explicit limiter settings for every upstream the app rate-limits; 0 disables the token bucket
+    rate_limit = parse_overrides(args.rate_limit)
+    max_concurrency = parse_overrides(args.max_concurrency, int)
+    return {
+        "max_in_flight": args.max_in_flight,
+        "max_per_sender": args.max_per_sender,
+        "upstreams": {
+            name: {
+                "rate_limit": rate_limit.get(name, 0.0),
+                "max_concurrency": max_concurrency.get(name, args.default_max_concurrency),
+            }
+            for name in LIMITED_UPSTREAMS
+        },
+    }
+
+
+def limit_environment(limits):
+    env = {
+        "MAX_IN_FLIGHT": str(limits["max_in_flight"]),
+        "MAX_PER_SENDER": str(limits["max_per_sender"]),
+    }
+    for name, upstream in limits["upstreams"].items():
+        env[f"RATE_LIMIT_{name.upper()}"] = str(upstream["rate_limit"])
+        env[f"RATE_BURST_{name.upper()}"] = str(max(1.0, upstream["rate_limit"]))
+        env[f"MAX_CONCURRENCY_{name.upper()}"] = str(upstream["max_concurrency"])
+    return env
+
+
+def start_app(fakes, limits, args):
+    # The app reads its configuration at import time, so the environment goes first
+    os.environ.update(app_environment(fakes))
+    os.environ.update(limit_environment(limits))
+    os.environ["ASYNC_REPLIES"] = "1" if args.async_replies else "0"
+    os.environ.pop("CACHE_DB_PATH", None)
+    # The report may go to stdout, so the app's JSON logs go to stderr
+    os.environ["LOG_STREAM"] = "stderr"
+
+    import app as bot
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, bot.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    return bot, server, f"http://127.0.0.1:{server.server_port}"
+
+
+def run_level(bot, url, fakes, concurrency, args, level_index):
+    import requests
+    from ratelimit import reset_limiters
+
+    for fake in fakes.values():
+        fake.reset_stats()
+    reset_limiters()
+    local = threading.local()
+    webhook_times, starts, errors, replies = [], {}, [], {}
+    lock = threading.Lock()
+
+    def send(i):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        idea_number = i % args.distinct_ideas if args.distinct_ideas else i
+        sender = f"whatsapp:+1555{level_index:02d}{i:06d}"
+        form = {"Body": f"benchmark topic {level_index}-{idea_number}", "From": sender, "To": "whatsapp:+14155238886"}
+        start = time.perf_counter()
+        error = None
+        messages = []
+        try:
+            response = session.post(f"{url}/whatsapp", data=form, timeout=args.timeout)
+            if response.status_code == 200:
+                messages = twiml_messages(response.text)
+            else:
+                error = str(response.status_code)
+        except Exception as e:
+            error = str(e)
+        elapsed = time.perf_counter() - start
+        with lock:
+            starts[sender] = start
+            webhook_times.append(elapsed)
+            if error is not None:
+                errors.append(error)
+            else:
+                replies[sender] = messages
+
+    metrics_session = requests.Session()
+    buckets_before = scrape_stage_buckets(metrics_session, url)
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, range(args.requests)))
+    finished = time.perf_counter()
+
+    first_message, last_message = [], []
+    if args.async_replies:
+        # Wait for the worker pool to drain, then read deliveries off the fake Twilio.
+        # The webhook itself only carries a reply when the job was shed.
+        deadline = time.perf_counter() + args.timeout
+        while bot.delivery_pool.queue.unfinished_tasks and time.perf_counter() < deadline:
+            time.sleep(0.05)
+        deliveries = dict(fakes["twilio"].deliveries)
+        for sender, messages in replies.items():
+            delivered = deliveries.get(sender)
+            if messages or not delivered:
+                continue
+            times = [at for at, _ in delivered]
+            first_message.append(min(times) - starts[sender])
+            last_message.append(max(times) - starts[sender])
+            replies[sender] = [body for _, body in sorted(delivered)]
+        if deliveries:
+            finished = max(at for delivered in deliveries.values() for at, _ in delivered)
+
+    outcomes = {"ok": 0, "degraded": 0, "shed": 0, "undelivered": 0}
+    reasons = {}
+    for messages in replies.values():
+        outcome, reason = classify(bot, messages)
+        outcomes[outcome or "undelivered"] += 1
+        if reason:
+            key = f"{outcome}.{reason}"
+            reasons[key] = reasons.get(key, 0) + 1
+
+    stages = {"webhook": percentiles(webhook_times)}
+    if args.async_replies:
+        stages["first_message"] = percentiles(first_message)
+        stages["last_message"] = percentiles(last_message)
+    for name, fake in fakes.items():
+        stages[f"upstream.{name}"] = percentiles(list(fake.service_times))
+    stages.update(bucket_percentiles(buckets_before, scrape_stage_buckets(metrics_session, url)))
+
+    duration = finished - began
+    return {
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "errors": len(errors),
+        **outcomes,
+        "outcome_reasons": reasons,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(args.requests / duration, 2) if duration else None,
+        "ok_throughput_rps": round(outcomes["ok"] / duration, 2) if duration else None,
+        "upstream_errors": {name: fake.errors for name, fake in fakes.items()},
+        "stages": stages,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the WhatsApp webhook")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=32, help="requests per concurrency level")
+    parser.add_argument("--async-replies", action="store_true", help="run with ASYNC_REPLIES=1")
+    parser.add_argument("--distinct-ideas", type=int, default=0, help="cycle through N ideas (0 = all unique)")
+    parser.add_argument("--latency", default="", help="median latency in ms per upstream, e.g. groq=400,brave=150")
+    parser.add_argument("--sigma", type=float, default=0.3, help="lognormal spread of upstream latency")
+    parser.add_argument("--error-rate", default="", help="failure probability per upstream, e.g. brave=0.05")
+    parser.add_argument("--error-status", default="", help="status code for injected failures, e.g. groq=429")
+    parser.add_argument("--stream-chunks", type=int, default=24, help="SSE chunks per Groq completion")
+    parser.add_argument("--chunk-delay", type=float, default=15, help="ms between Groq SSE chunks")
+    parser.add_argument("--rate-limit", default="", help="app-side requests/s per upstream, e.g. groq=0.5 (default: off)")
+    parser.add_argument("--max-concurrency", default="", help="app-side starting concurrency limit per upstream, e.g. groq=8")
+    parser.add_argument("--default-max-concurrency", type=int, default=32, help="concurrency limit for upstreams not in --max-concurrency")
+    parser.add_argument("--max-in-flight", type=int, default=32, help="app admission cap on concurrent sync requests")
+    parser.add_argument("--max-per-sender", type=int, default=2, help="app admission cap per sender")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request and drain timeout in seconds")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    profiles = build_profiles(args)
+    limits = build_limits(args)
+    fakes = start_fakes(profiles)
+    bot, server, url = start_app(fakes, limits, args)
+    try:
+        levels = [
+            run_level(bot, url, fakes, int(level), args, index)
+            for index, level in enumerate(args.concurrency.split(","))
+        ]
+    finally:
+        server.shutdown()
+        for fake in fakes.values():
+            fake.stop()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {
+            "async_replies": args.async_replies,
+            "requests_per_level": args.requests,
+            "distinct_ideas": args.distinct_ideas,
+            "profiles": {name: profile.as_dict() for name, profile in profiles.items()},
+            "limits": limits,
+        },
+        "levels": levels,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+from telemetry import log_event
+
+load_dotenv()
+
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "512"))
+# Optional on-disk tier that survives restarts, e.g. CACHE_DB_PATH=cache.sqlite3
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH")
+# How long an expired entry may still be served while it is refreshed in the background
+CACHE_STALE_TTL = float(os.getenv("CACHE_STALE_TTL", "300"))
+
+# Sentence punctuation and chat formatting around a word; "+", "#", "@", "/" etc. stay
+# because they change the topic ("C++" vs "C#" vs "C")
+_EDGE_PUNCTUATION = "\"'`.,!?;:()[]{}<>*_~…“”‘’«»¡¿-–—"
+_REPEATED_PUNCTUATION = re.compile(r"([.,!?;:…\-–—])\1+")
+
+
+def normalize_key(text):
+    # Folds case, whitespace and punctuation around or repeated within words; keeps the rest
+    words = (_REPEATED_PUNCTUATION.sub(r"\1", word).strip(_EDGE_PUNCTUATION) for word in (text or "").lower().split())
+    return " ".join(word for word in words if word)
+
+
+class TieredCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, db_path=CACHE_DB_PATH, stale_ttl=CACHE_STALE_TTL):
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self._memory = OrderedDict()  # (namespace, key) -> (value, expires_at)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._stats = {}
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT, key TEXT, value TEXT, expires_at REAL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._db.commit()
+
+    def _count(self, namespace, field):
+        with self._lock:
+            counts = self._stats.setdefault(namespace, {"hits": 0, "stale_hits": 0, "misses": 0})
+            counts[field] += 1
+
+    def _lookup(self, namespace, key):
+        with self._lock:
+            entry = self._memory.get((namespace, key))
+            if entry is not None:
+                self._memory.move_to_end((namespace, key))
+                return entry
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+        if row is None:
+            return None
+        entry = (json.loads(row[0]), row[1])
+        self._remember(namespace, key, entry)
+        return entry
+
+    def _remember(self, namespace, key, entry):
+        with self._lock:
+            self._memory[(namespace, key)] = entry
+            self._memory.move_to_end((namespace, key))
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, namespace, key):
+        entry = self._lookup(namespace, key)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def set(self, namespace, key, value, ttl):
+        entry = (value, time.time() + ttl)
+        self._remember(namespace, key, entry)
+        if self._db is not None:
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (namespace, key, json.dumps(value), entry[1]),
+                )
+                self._db.execute("DELETE FROM cache WHERE expires_at < ?", (time.time() - self.stale_ttl,))
+                self._db.commit()
+
+    def _refresh(self, namespace, key, compute, ttl):
+        try:
+            value = compute()
+            if ttl is not None:
+                self.set(namespace, key, value, ttl)
+        except Exception as e:
+            log_event("cache_refresh_failed", logging.WARNING, namespace=namespace, key=key, error=str(e))
+        finally:
+            with self._lock:
+                self._refreshing.discard((namespace, key))
+
+    def servable(self, namespace, key):
+        # Whether peek() would return a value, without counting a lookup or starting a refresh
+        entry = self._lookup(namespace, key)
+        return entry is not None and entry[1] + self.stale_ttl > time.time()
+
+    def peek(self, namespace, key, refresh=None, ttl=None):
+        # Fresh or still-servable stale value, else None; stale entries are refreshed with refresh(),
+        # whose result is stored for ttl (with ttl=None, refresh() stores its own result)
+        entry = self._lookup(namespace, key)
+        now = time.time()
+        if entry is not None and entry[1] > now:
+            self._count(namespace, "hits")
+            return entry[0]
+
+        if entry is not None and entry[1] + self.stale_ttl > now:
+            self._count(namespace, "stale_hits")
+            if refresh is not None:
+                with self._lock:
+                    start_refresh = (namespace, key) not in self._refreshing
+                    self._refreshing.add((namespace, key))
+                if start_refresh:
+                    threading.Thread(
+                        target=self._refresh, args=(namespace, key, refresh, ttl), daemon=True
+                    ).start()
+            return entry[0]
+
+        self._count(namespace, "misses")
+        return None
+
+    def get_or_compute(self, namespace, key, compute, ttl):
+        # Exceptions from compute() propagate and are never cached
+        value = self.peek(namespace, key, compute, ttl)
+        if value is not None:
+            return value
+        value = compute()
+        self.set(namespace, key, value, ttl)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {namespace: dict(counts) for namespace, counts in self._stats.items()}
+
+
+cache = TieredCache()
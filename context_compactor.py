@@ -0,0 +1,108 @@
+import math
+import os
+import re
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Rough token budgets for prompt context; override per source with e.g. CONTEXT_TOKEN_BUDGET_WIKIPEDIA
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "600"))
+SOURCE_TOKEN_BUDGET = int(os.getenv("SOURCE_TOKEN_BUDGET", "250"))
+# Word-set overlap above which two snippets count as the same fact
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.8"))
+
+_WORD = re.compile(r"\w+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "is", "are", "was", "were",
+    "be", "by", "with", "as", "at", "it", "its", "that", "this", "from", "title", "snippet", "url",
+}
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for English text, close enough for budgeting
+    return math.ceil(len(text) / 4)
+
+
+def source_budget(name):
+    return int(os.getenv(f"CONTEXT_TOKEN_BUDGET_{name.upper()}", SOURCE_TOKEN_BUDGET))
+
+
+def _words(text):
+    text = "\n".join(line for line in text.split("\n") if not line.startswith("URL:"))
+    return {word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS}
+
+
+def split_snippets(text):
+    # Search/Reddit results are blank-line separated blocks; prose is split into sentences
+    if "\n" in text:
+        return [block.strip() for block in text.split("\n\n") if block.strip()], "\n\n"
+    return [sentence.strip() for sentence in _SENTENCE_END.split(text) if sentence.strip()], " "
+
+
+def _is_duplicate(words, kept):
+    for other in kept:
+        union = words | other
+        if union and len(words & other) / len(union) >= DUPLICATE_THRESHOLD:
+            return True
+    return False
+
+
+def _truncate(text, budget):
+    words = text.split(" ")
+    while words and estimate_tokens(" ".join(words) + " ...") > budget:
+        words.pop()
+    return " ".join(words) + " ..." if words else ""
+
+
+def compact_sources(idea, results, total_budget=CONTEXT_TOKEN_BUDGET):
+    # Returns (compacted results, stats); snippets keep their original order within a source
+    idea_words = _words(idea or "")
+    kept_words = []
+    candidates = []  # (score, name, position, snippet, tokens)
+    separators = {}
+    duplicates = 0
+    tokens_before = sum(estimate_tokens(text) for text in results.values())
+
+    for name, text in results.items():
+        snippets, separators[name] = split_snippets(text)
+        for position, snippet in enumerate(snippets):
+            words = _words(snippet)
+            if words and _is_duplicate(words, kept_words):
+                duplicates += 1
+                continue
+            kept_words.append(words)
+            relevance = len(words & idea_words) / len(idea_words) if idea_words else 0.0
+            # Earlier snippets (lead sentences, top results) break ties
+            score = relevance + 0.1 / (1 + position)
+            candidates.append((score, name, position, snippet, estimate_tokens(snippet)))
+
+    selected = {name: [] for name in results}
+    used = {name: 0 for name in results}
+    total = 0
+    for score, name, position, snippet, tokens in sorted(candidates, key=lambda c: (-c[0], c[2])):
+        budget = min(source_budget(name) - used[name], total_budget - total)
+        if tokens > budget:
+            if selected[name] or budget <= 0:
+                continue
+            # Keep at least the head of the best snippet rather than dropping the source
+            snippet = _truncate(snippet, budget)
+            tokens = estimate_tokens(snippet)
+            if not snippet:
+                continue
+        selected[name].append((position, snippet))
+        used[name] += tokens
+        total += tokens
+
+    compacted = {}
+    for name, text in results.items():
+        chosen = [snippet for _, snippet in sorted(selected[name])]
+        compacted[name] = separators[name].join(chosen)
+
+    stats = {
+        "tokens_before": tokens_before,
+        "tokens_after": total,
+        "tokens_saved": max(0, tokens_before - total),
+        "duplicates_dropped": duplicates,
+    }
+    return compacted, stats
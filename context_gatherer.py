@@ -1,7 +1,16 @@
-import requests
+import contextvars
+import logging
 import os
+import threading
+import time
 import praw
+import http_client
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from dotenv import load_dotenv
+from cache import cache, normalize_key
+from ratelimit import RateLimited, get_limiter
+from singleflight import SingleFlight
+from telemetry import UPSTREAM_ERRORS, log_event, span
 
 load_dotenv()
 
@@ -11,72 +20,194 @@ REDDIT_CLIENT_ID = os.getenv("REDDIT_CLIENT_ID")
 REDDIT_CLIENT_SECRET = os.getenv("REDDIT_CLIENT_SECRET")
 REDDIT_USER_AGENT = os.getenv("REDDIT_USER_AGENT")
 
-# Initialize Reddit
-reddit = praw.Reddit(
-    client_id=REDDIT_CLIENT_ID,
-    client_secret=REDDIT_CLIENT_SECRET,
-    user_agent=REDDIT_USER_AGENT
-)
+# Upstream endpoints; overridden to point at local fakes when benchmarking
+WIKIPEDIA_API_URL = os.getenv("WIKIPEDIA_API_URL", "https://en.wikipedia.org/api/rest_v1/page/summary")
+BRAVE_API_URL = os.getenv("BRAVE_API_URL", "https://api.search.brave.com/res/v1/web/search")
+REDDIT_URL = os.getenv("REDDIT_URL", "https://www.reddit.com")
+REDDIT_OAUTH_URL = os.getenv("REDDIT_OAUTH_URL", "https://oauth.reddit.com")
+
+# Time budget (seconds) for the whole fan-out and the default per-source deadline
+CONTEXT_TIMEOUT = float(os.getenv("CONTEXT_TIMEOUT", "4"))
+SOURCE_TIMEOUT = float(os.getenv("CONTEXT_SOURCE_TIMEOUT", "3"))
+# Size for expected concurrent requests x registered sources (~16 x 3)
+CONTEXT_WORKERS = int(os.getenv("CONTEXT_WORKERS", "48"))
+
+# Cache TTLs (seconds) per source: encyclopedia summaries age slowly, search results don't
+WIKIPEDIA_TTL = float(os.getenv("WIKIPEDIA_CACHE_TTL", str(3 * 24 * 3600)))
+BRAVE_TTL = float(os.getenv("BRAVE_CACHE_TTL", "600"))
+REDDIT_TTL = float(os.getenv("REDDIT_CACHE_TTL", "300"))
+
+_reddit = None
+_reddit_lock = threading.Lock()
+
+# Shared pool; late fetches keep running here instead of blocking the reply
+_executor = ThreadPoolExecutor(max_workers=CONTEXT_WORKERS, thread_name_prefix="context")
+
+source_flights = SingleFlight()
+
+# name -> {"label": ..., "fetcher": ..., "timeout": ..., "ttl": ...}, in prompt order
+SOURCES = {}
+
+
+def get_reddit():
+    # Built on first use to keep imports (and cold starts) cheap
+    global _reddit
+    with _reddit_lock:
+        if _reddit is None:
+            _reddit = praw.Reddit(
+                client_id=REDDIT_CLIENT_ID,
+                client_secret=REDDIT_CLIENT_SECRET,
+                user_agent=REDDIT_USER_AGENT,
+                reddit_url=REDDIT_URL,
+                oauth_url=REDDIT_OAUTH_URL,
+                requestor_kwargs={"session": http_client.get_session("reddit")}
+            )
+        return _reddit
+
+
+def register_source(name, label, fetcher, timeout=None, ttl=0):
+    SOURCES[name] = {
+        "label": label,
+        "fetcher": fetcher,
+        "timeout": SOURCE_TIMEOUT if timeout is None else timeout,
+        "ttl": ttl,
+    }
+    return fetcher
+
 
 def fetch_wikipedia_intro(topic):
-    try:
-        url = f"https://en.wikipedia.org/api/rest_v1/page/summary/{topic.replace(' ', '_')}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("extract", "No summary available.")
-        else:
-            return f"No Wikipedia entry found for '{topic}'."
-    except Exception as e:
-        return f"[Wikipedia Error] {str(e)}"
+    url = f"{WIKIPEDIA_API_URL}/{topic.replace(' ', '_')}"
+    response = http_client.get("wikipedia", url, timeout=SOURCES["wikipedia"]["timeout"])
+    if response.status_code == 200:
+        data = response.json()
+        return data.get("extract", "No summary available.")
+    elif response.status_code == 404:
+        return f"No Wikipedia entry found for '{topic}'."
+    response.raise_for_status()
+    return f"No Wikipedia entry found for '{topic}'."
+
 
 def fetch_brave_articles(topic):
-    try:
-        url = "https://api.search.brave.com/res/v1/web/search"
-        headers = {
-            "Accept": "application/json",
-            "X-Subscription-Token": BRAVE_API_KEY
-        }
-        params = {
-            "q": topic,
-            "count": 3
-        }
-        response = requests.get(url, headers=headers, params=params)
-        results = response.json().get("web", {}).get("results", [])
-
-        if not results:
-            return "No Brave Search results found."
-
-        summaries = []
-        for result in results:
-            summaries.append(f"Title: {result['title']}\nSnippet: {result['description']}\nURL: {result['url']}")
-
-        return "\n\n".join(summaries)
-    except Exception as e:
-        return f"[Brave Search Error] {str(e)}"
+    url = BRAVE_API_URL
+    headers = {
+        "Accept": "application/json",
+        "X-Subscription-Token": BRAVE_API_KEY
+    }
+    params = {
+        "q": topic,
+        "count": 3
+    }
+    response = http_client.get("brave", url, headers=headers, params=params, timeout=SOURCES["brave"]["timeout"])
+    response.raise_for_status()
+    results = response.json().get("web", {}).get("results", [])
+
+    if not results:
+        return "No Brave Search results found."
+
+    summaries = []
+    for result in results:
+        summaries.append(f"Title: {result['title']}\nSnippet: {result['description']}\nURL: {result['url']}")
+
+    return "\n\n".join(summaries)
+
 
 def fetch_reddit_summary(topic, limit=3):
-    try:
-        posts = reddit.subreddit("all").search(topic, limit=limit, sort="relevance")
-        summaries = []
-        for post in posts:
-            if not post.stickied:
-                summaries.append(f"Title: {post.title}\nUpvotes: {post.score}\nComments: {post.num_comments}")
-        return "\n\n".join(summaries)
-    except Exception as e:
-        return f"[Reddit Error] {str(e)}"
-
-def gather_context(topic):
-    wiki = fetch_wikipedia_intro(topic)
-    brave = fetch_brave_articles(topic)
-    reddit = fetch_reddit_summary(topic)
-
-    return f"""📚 Wikipedia:
-{wiki}
-
-📰 Brave Search:
-{brave}
-
-🔥 Reddit Posts:
-{reddit}
-"""
+    posts = get_reddit().subreddit("all").search(topic, limit=limit, sort="relevance")
+    summaries = []
+    for post in posts:
+        if not post.stickied:
+            summaries.append(f"Title: {post.title}\nUpvotes: {post.score}\nComments: {post.num_comments}")
+    return "\n\n".join(summaries)
+
+
+register_source("wikipedia", "📚 Wikipedia", fetch_wikipedia_intro, ttl=WIKIPEDIA_TTL)
+register_source("brave", "📰 Brave Search", fetch_brave_articles, ttl=BRAVE_TTL)
+register_source("reddit", "🔥 Reddit Posts", fetch_reddit_summary, ttl=REDDIT_TTL)
+
+
+def _fetch_limited(name, topic):
+    # Runs on the shared context pool, so it never sleeps waiting for a rate-limit slot;
+    # a source over its limit is reported missing right away
+    source = SOURCES[name]
+    with get_limiter(name).slot(0):
+        return source["fetcher"](topic)
+
+
+def fetch_source(name, topic):
+    source = SOURCES[name]
+    key = normalize_key(topic)
+    fetch = lambda: source_flights.do(f"{name}:{key}", lambda: _fetch_limited(name, topic))
+    with span(f"context.{name}"):
+        if not source["ttl"]:
+            return fetch()
+        return cache.get_or_compute(name, key, fetch, source["ttl"])
+
+
+def _run_source(started, name, topic):
+    started[name] = time.monotonic()
+    return fetch_source(name, topic)
+
+
+def _wait_for_source(name, future, started, overall_deadline):
+    # A source's own deadline runs from when its fetch starts, not from when it was
+    # queued, so a busy pool doesn't turn healthy upstreams into timeouts
+    while True:
+        begun = started.get(name)
+        if begun is None:
+            deadline = min(overall_deadline, time.monotonic() + 0.05)
+        else:
+            deadline = min(overall_deadline, begun + SOURCES[name]["timeout"])
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            if begun is not None or time.monotonic() >= overall_deadline:
+                raise
+
+
+def gather_sources(topic, timeout=None):
+    # Returns ({name: text}, {name: reason}) for sources that answered / didn't in time
+    budget = CONTEXT_TIMEOUT if timeout is None else timeout
+    overall_deadline = time.monotonic() + budget
+    started = {}
+    # Copy the context so per-source spans land in the caller's request trace
+    futures = {
+        name: _executor.submit(contextvars.copy_context().run, _run_source, started, name, topic)
+        for name in SOURCES
+    }
+
+    results, missing = {}, {}
+    for name, future in futures.items():
+        try:
+            results[name] = _wait_for_source(name, future, started, overall_deadline)
+        except FutureTimeout:
+            future.cancel()
+            missing[name] = "timed out"
+            UPSTREAM_ERRORS.inc(name, "timeout")
+        except RateLimited as e:
+            missing[name] = f"rate limited ({e.reason})"
+            UPSTREAM_ERRORS.inc(name, "rate_limited")
+        except Exception as e:
+            missing[name] = f"error: {e}"
+            UPSTREAM_ERRORS.inc(name, "error")
+
+    if missing:
+        log_event("context_missing", logging.WARNING, topic=topic, missing=missing)
+    return results, missing
+
+
+def format_context(results, missing):
+    blocks = []
+    for name, source in SOURCES.items():
+        if name in results:
+            blocks.append(f"{source['label']}:\n{results[name]}")
+        elif name in missing:
+            blocks.append(f"{source['label']}:\n[Unavailable: {missing[name]}]")
+
+    context = "\n\n".join(blocks) + "\n"
+    if missing:
+        context += f"\n⚠️ Missing sources: {', '.join(SOURCES[name]['label'] for name in missing)}\n"
+    return context
+
+
+def gather_context(topic, timeout=None):
+    return format_context(*gather_sources(topic, timeout))
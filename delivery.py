@@ -0,0 +1,116 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+import http_client
+from dotenv import load_dotenv
+from ratelimit import FairQueue
+from telemetry import UPSTREAM_ERRORS, log_event, span
+
+load_dotenv()
+
+TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
+TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
+# Point at a local fake Twilio server when testing
+TWILIO_API_BASE = os.getenv("TWILIO_API_BASE", "https://api.twilio.com")
+
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "4"))
+DELIVERY_QUEUE_SIZE = int(os.getenv("DELIVERY_QUEUE_SIZE", "100"))
+# Queued jobs allowed per recipient; jobs are served round-robin across recipients
+DELIVERY_MAX_PER_SENDER = int(os.getenv("DELIVERY_MAX_PER_SENDER", "3"))
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "3"))
+DELIVERY_RETRY_BACKOFF = float(os.getenv("DELIVERY_RETRY_BACKOFF", "0.5"))
+DEAD_LETTER_LIMIT = int(os.getenv("DEAD_LETTER_LIMIT", "500"))
+
+# At most one send per worker is in flight, so that many kept-alive connections cover it
+http_client.set_pool_size("twilio", DELIVERY_WORKERS)
+
+
+class PermanentDeliveryError(Exception):
+    pass
+
+
+class TwilioRestSender:
+    def __init__(self, account_sid=TWILIO_ACCOUNT_SID, auth_token=TWILIO_AUTH_TOKEN, api_base=TWILIO_API_BASE, timeout=5):
+        self.url = f"{api_base.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self.auth = (account_sid, auth_token)
+        self.timeout = timeout
+
+    def send(self, to, from_, body):
+        response = http_client.post(
+            "twilio",
+            self.url,
+            data={"To": to, "From": from_, "Body": body},
+            auth=self.auth,
+            timeout=self.timeout
+        )
+        if 400 <= response.status_code < 500 and response.status_code != 429:
+            # Bad number, unverified sender, ...: retrying won't help
+            raise PermanentDeliveryError(f"Twilio {response.status_code}: {response.text}")
+        response.raise_for_status()
+        return response.json().get("sid")
+
+
+class DeliveryPool:
+    # handler(job) yields message bodies; each one is sent to job["to"] from job["from"]
+    def __init__(self, handler, sender, workers=DELIVERY_WORKERS, max_queue=DELIVERY_QUEUE_SIZE,
+                 max_attempts=DELIVERY_MAX_ATTEMPTS, retry_backoff=DELIVERY_RETRY_BACKOFF,
+                 max_per_sender=DELIVERY_MAX_PER_SENDER):
+        self.handler = handler
+        self.sender = sender
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.queue = FairQueue(max_queue, max_per_sender, key=lambda job: job["to"])
+        self.dead_letters = deque(maxlen=DEAD_LETTER_LIMIT)
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Started lazily so forking WSGI servers don't inherit dead threads
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"delivery-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, job):
+        # Returns "queued", or why the job was shed: "sender_busy" or "overloaded"
+        self.start()
+        reason = self.queue.put_nowait(job)
+        if reason is not None:
+            log_event("delivery_rejected", logging.WARNING, reason=reason, depth=self.queue.qsize(), to=job["to"])
+            return reason
+        return "queued"
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                for body in self.handler(job):
+                    self._send(job, body)
+            except Exception as e:
+                log_event("delivery_job_failed", logging.ERROR, to=job["to"], error=str(e))
+                self.dead_letters.append({"job": job, "body": None, "error": str(e), "attempts": 0})
+            finally:
+                self.queue.task_done()
+
+    def _send(self, job, body):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                with span("delivery_send"):
+                    self.sender.send(job["to"], job["from"], body)
+                return
+            except Exception as e:
+                UPSTREAM_ERRORS.inc("twilio", "error")
+                if isinstance(e, PermanentDeliveryError) or attempt == self.max_attempts:
+                    log_event("delivery_failed", logging.ERROR, to=job["to"], attempts=attempt, error=str(e))
+                    self.dead_letters.append({"job": job, "body": body, "error": str(e), "attempts": attempt})
+                    return
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
@@ -0,0 +1,124 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+from ratelimit import max_concurrency
+
+load_dotenv()
+
+# Connections kept alive per upstream host. By default a pool holds as many connections as
+# calls can be in flight to that upstream (its MAX_CONCURRENCY_<NAME> limit, or a size set
+# with set_pool_size()), so concurrent calls don't open connections that are then thrown away.
+# Override for every upstream with HTTP_POOL_SIZE, or per upstream with e.g. HTTP_POOL_SIZE_GROQ.
+HTTP_POOL_SIZE = os.getenv("HTTP_POOL_SIZE")
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "2"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "6"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.2"))
+
+_sessions = {}
+_pool_sizes = {}
+_lock = threading.Lock()
+
+
+class _CountingPoolMixin:
+    # Counts connections closed on return because the pool was already full
+    num_discarded = 0
+
+    def _put_conn(self, conn):
+        if conn is not None and self.pool is not None and self.pool.full():
+            self.num_discarded += 1
+        super()._put_conn(conn)
+
+
+class _CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class _CountingAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+
+def set_pool_size(name, size):
+    # For upstreams whose concurrency isn't set by a rate limiter (e.g. a fixed worker pool);
+    # takes effect if called before the session is first used
+    _pool_sizes[name] = size
+
+
+def _pool_size(name):
+    size = os.getenv(f"HTTP_POOL_SIZE_{name.upper()}", HTTP_POOL_SIZE)
+    if size:
+        return int(size)
+    return _pool_sizes.get(name) or max_concurrency(name)
+
+
+def get_session(name):
+    # One keep-alive session per upstream, created on first use
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+    with _lock:
+        if name not in _sessions:
+            retry = Retry(
+                total=HTTP_RETRIES,
+                backoff_factor=HTTP_RETRY_BACKOFF,
+                backoff_jitter=HTTP_RETRY_BACKOFF,
+                status_forcelist=(502, 503, 504),  # POST is only retried on connect errors
+                raise_on_status=False,
+            )
+            adapter = _CountingAdapter(pool_connections=4, pool_maxsize=_pool_size(name), max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[name] = session
+        return _sessions[name]
+
+
+def request(name, method, url, **kwargs):
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    return get_session(name).request(method, url, **kwargs)
+
+
+def get(name, url, **kwargs):
+    return request(name, "GET", url, **kwargs)
+
+
+def post(name, url, **kwargs):
+    return request(name, "POST", url, **kwargs)
+
+
+def pool_stats():
+    # {upstream: {host: {"opened", "requests", "reused", "discarded", "idle"}}}; many discarded
+    # connections mean the pool is smaller than the upstream's concurrency
+    stats = {}
+    with _lock:
+        sessions = dict(_sessions)
+    for name, session in sessions.items():
+        hosts = stats.setdefault(name, {})
+        for adapter in {id(a): a for a in session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = f"{pool.scheme}://{pool.host}:{pool.port}"
+                hosts[host] = {
+                    "opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    "reused": max(0, pool.num_requests - pool.num_connections),
+                    "discarded": getattr(pool, "num_discarded", 0),
+                    "idle": sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0,
+                }
+    return stats
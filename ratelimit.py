@@ -0,0 +1,319 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from telemetry import Counter, Gauge, register
+
+load_dotenv()
+
+# Local limits are opt-in per upstream: RATE_LIMIT_<NAME> (requests/s) enables a token
+# bucket with RATE_BURST_<NAME> tokens (default: one second's worth). Without it only the
+# adaptive concurrency limit applies, starting at MAX_CONCURRENCY_<NAME> and shrinking on
+# 429s or rising latency. Set these to match each provider's plan, e.g. RATE_LIMIT_GROQ=0.5.
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("DEFAULT_MAX_CONCURRENCY", "32"))
+# A call slower than baseline * LATENCY_TOLERANCE counts as congestion; the baseline is an
+# EWMA of successful calls' latency with this smoothing factor
+LATENCY_TOLERANCE = float(os.getenv("LATENCY_TOLERANCE", "2.0"))
+BASELINE_SMOOTHING = float(os.getenv("LATENCY_BASELINE_SMOOTHING", "0.1"))
+# Admission: concurrent requests overall and per WhatsApp sender
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "32"))
+MAX_PER_SENDER = int(os.getenv("MAX_PER_SENDER", "2"))
+# Requests admitted per unit of Groq's current concurrency limit, so admission tightens as Groq backs off
+ADMISSION_QUEUE_FACTOR = float(os.getenv("ADMISSION_QUEUE_FACTOR", "4"))
+
+RATE_LIMITED = register(Counter(
+    "bot_rate_limited_total", "Upstream calls refused locally or throttled (429) remotely.", ("upstream", "where")
+))
+ADMISSION_REJECTED = register(Counter("bot_admission_rejected_total", "Requests shed at admission.", ("reason",)))
+
+
+class RateLimited(Exception):
+    def __init__(self, upstream, reason):
+        super().__init__(f"{upstream} {reason}")
+        self.upstream = upstream
+        self.reason = reason
+
+
+def _status_code(error):
+    # requests.HTTPError and prawcore.ResponseException both carry the response
+    return getattr(getattr(error, "response", None), "status_code", None)
+
+
+def _retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout):
+        # Reserves a token (the balance may go negative) and sleeps until it is due;
+        # refuses immediately if that would take longer than timeout
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = max(0.0, (1 - self.tokens) / self.rate)
+            if wait > timeout:
+                return False
+            self.tokens -= 1
+        if wait:
+            time.sleep(wait)
+        return True
+
+
+class AdaptiveLimiter:
+    # AIMD concurrency limit: grows by ~1 per window of successful calls, shrinks
+    # multiplicatively on 429s or when latency climbs well above its typical value
+    def __init__(self, max_limit, min_limit=1, backoff=0.7):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.backoff = backoff
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.baseline = None
+        self.blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.blocked_until > deadline:
+                    return False  # the upstream asked us to back off for longer than we can wait
+                if now >= self.blocked_until and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return True
+                if now >= deadline:
+                    return False
+                self._cond.wait(min(deadline, max(self.blocked_until, now + 0.05)) - now)
+
+    def release(self, latency, outcome="ok", retry_after=0.0):
+        # outcome: "ok", "throttled" (429) or "failed"; failures say nothing about load,
+        # and a fast connection error must not drag the latency baseline down
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            congested = outcome == "throttled"
+            if outcome == "ok":
+                if self.baseline is None:
+                    self.baseline = latency
+                congested = latency > self.baseline * LATENCY_TOLERANCE
+                self.baseline += (latency - self.baseline) * BASELINE_SMOOTHING
+
+            if congested:
+                # At most one decrease per second so a burst of slow calls isn't over-counted
+                if now - self._last_decrease >= 1.0:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, now + retry_after)
+            elif outcome == "ok":
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class Slot:
+    def __init__(self):
+        self.latency = None
+
+    def mark_latency(self, seconds):
+        # For streams: report time-to-first-token instead of the whole hold time
+        self.latency = seconds
+
+
+class UpstreamLimiter:
+    def __init__(self, name, rate, burst, max_concurrency):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.concurrency = AdaptiveLimiter(max_concurrency)
+
+    @contextmanager
+    def slot(self, timeout):
+        # timeout=0 never sleeps: callers on shared pool threads should fail fast
+        deadline = time.monotonic() + timeout
+        if self.bucket is not None and not self.bucket.acquire(timeout):
+            RATE_LIMITED.inc(self.name, "local")
+            raise RateLimited(self.name, "rate limit")
+        if not self.concurrency.acquire(max(0.0, deadline - time.monotonic())):
+            RATE_LIMITED.inc(self.name, "local")
+            raise RateLimited(self.name, "concurrency limit")
+
+        slot = Slot()
+        start = time.monotonic()
+        outcome, retry_after = "failed", 0.0
+        try:
+            yield slot
+            outcome = "ok"
+        except Exception as e:
+            if _status_code(e) == 429:
+                outcome, retry_after = "throttled", _retry_after(e)
+                RATE_LIMITED.inc(self.name, "remote")
+                raise RateLimited(self.name, "throttled by upstream") from e
+            raise
+        finally:
+            latency = slot.latency if slot.latency is not None else time.monotonic() - start
+            self.concurrency.release(latency, outcome, retry_after)
+
+    def cooling_down(self):
+        return time.monotonic() < self.concurrency.blocked_until
+
+    def capacity(self, factor):
+        return max(1, int(self.concurrency.limit * factor))
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def max_concurrency(name):
+    # The most calls that can hold a slot for this upstream at once
+    return int(os.getenv(f"MAX_CONCURRENCY_{name.upper()}", DEFAULT_MAX_CONCURRENCY))
+
+
+def get_limiter(name):
+    with _limiters_lock:
+        if name not in _limiters:
+            rate = float(os.getenv(f"RATE_LIMIT_{name.upper()}", "0"))
+            _limiters[name] = UpstreamLimiter(
+                name,
+                rate,
+                float(os.getenv(f"RATE_BURST_{name.upper()}", max(1.0, rate))),
+                max_concurrency(name),
+            )
+        return _limiters[name]
+
+
+def reset_limiters():
+    # Drop every limiter so the next get_limiter() starts fresh from the current environment
+    with _limiters_lock:
+        _limiters.clear()
+
+
+def _limiter_stats(field):
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return [((name, ), getattr(limiter.concurrency, field)) for name, limiter in limiters.items()]
+
+
+register(Gauge("bot_upstream_concurrency_limit", "Current adaptive concurrency limit.", ("upstream",),
+               lambda: [(labels, round(value, 2)) for labels, value in _limiter_stats("limit")]))
+register(Gauge("bot_upstream_in_flight", "Calls currently holding an upstream slot.", ("upstream",),
+               lambda: _limiter_stats("in_flight")))
+
+
+class FairQueue:
+    # queue.Queue-like, with one FIFO per key served round-robin so a single
+    # heavy sender can't starve everyone else
+    def __init__(self, maxsize, max_per_key, key=lambda item: item):
+        self.maxsize = maxsize
+        self.max_per_key = max_per_key
+        self.key = key
+        self._queues = OrderedDict()  # key -> deque, in round-robin order
+        self._size = 0
+        self.unfinished_tasks = 0
+        self._cond = threading.Condition()
+
+    def put_nowait(self, item):
+        # Returns None when queued, otherwise the rejection reason
+        key = self.key(item)
+        with self._cond:
+            pending = self._queues.get(key)
+            if pending is not None and len(pending) >= self.max_per_key:
+                reason = "sender_busy"
+            elif self._size >= self.maxsize:
+                reason = "overloaded"
+            else:
+                reason = None
+            if reason is not None:
+                ADMISSION_REJECTED.inc(reason)
+                return reason
+            if pending is None:
+                pending = self._queues[key] = deque()
+            pending.append(item)
+            self._size += 1
+            self.unfinished_tasks += 1
+            self._cond.notify()
+            return None
+
+    def get(self):
+        with self._cond:
+            while not self._size:
+                self._cond.wait()
+            key, pending = next(iter(self._queues.items()))
+            item = pending.popleft()
+            del self._queues[key]
+            if pending:
+                self._queues[key] = pending  # back of the rotation
+            self._size -= 1
+            return item
+
+    def task_done(self):
+        with self._cond:
+            self.unfinished_tasks -= 1
+
+    def qsize(self):
+        with self._cond:
+            return self._size
+
+
+class Admission:
+    # Sync-path gate: caps concurrent requests overall and per sender, and sheds
+    # immediately instead of letting requests queue past Twilio's webhook deadline
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, max_per_sender=MAX_PER_SENDER):
+        self.max_in_flight = max_in_flight
+        self.max_per_sender = max_per_sender
+        self.in_flight = 0
+        self.per_sender = {}
+        self._lock = threading.Lock()
+
+    def try_enter(self, sender, needs_groq=True):
+        # Returns None when admitted, otherwise the rejection reason. Requests that can be
+        # answered without Groq (e.g. from the script cache) skip the Groq-derived limits.
+        limit, cooling_down = self.max_in_flight, False
+        if needs_groq:
+            groq = get_limiter("groq")
+            limit = min(limit, groq.capacity(ADMISSION_QUEUE_FACTOR))
+            cooling_down = groq.cooling_down()
+        with self._lock:
+            if self.per_sender.get(sender, 0) >= self.max_per_sender:
+                reason = "sender_busy"
+            elif self.in_flight >= limit or cooling_down:
+                reason = "overloaded"
+            else:
+                self.in_flight += 1
+                self.per_sender[sender] = self.per_sender.get(sender, 0) + 1
+                return None
+        ADMISSION_REJECTED.inc(reason)
+        return reason
+
+    def leave(self, sender):
+        with self._lock:
+            self.in_flight -= 1
+            self.per_sender[sender] -= 1
+            if not self.per_sender[sender]:
+                del self.per_sender[sender]
+
+    @contextmanager
+    def admit(self, sender, needs_groq=True):
+        reason = self.try_enter(sender, needs_groq)
+        if reason is not None:
+            yield reason
+            return
+        try:
+            yield None
+        finally:
+            self.leave(sender)
@@ -0,0 +1,87 @@
+import threading
+
+
+class FlightCancelled(Exception):
+    pass
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.cancelled = False
+
+
+class SingleFlight:
+    # Concurrent callers with the same key share one in-flight computation
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "coalesced": 0, "errors": 0, "cancelled": 0}
+
+    def begin(self, key):
+        # Returns (call, is_leader); the leader must finish() or cancel() the call
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats["coalesced"] += 1
+                return call, False
+            call = _Call()
+            self._calls[key] = call
+            self._stats["leaders"] += 1
+            return call, True
+
+    def _complete(self, key, call):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.done.set()
+
+    def finish(self, key, call, result=None, error=None):
+        call.result, call.error = result, error
+        if error is not None:
+            with self._lock:
+                self._stats["errors"] += 1
+        self._complete(key, call)
+
+    def cancel(self, key, call):
+        # Leader gave up (e.g. its stream was closed); waiters retry instead of failing
+        call.cancelled = True
+        with self._lock:
+            self._stats["cancelled"] += 1
+        self._complete(key, call)
+
+    def wait(self, call, timeout=None):
+        # A waiter timing out only abandons its own wait, never the leader's work
+        if not call.done.wait(timeout):
+            raise TimeoutError("timed out waiting for in-flight request")
+        if call.cancelled:
+            raise FlightCancelled()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do(self, key, fn, timeout=None):
+        while True:
+            call, leader = self.begin(key)
+            if not leader:
+                try:
+                    return self.wait(call, timeout)
+                except FlightCancelled:
+                    continue
+
+            try:
+                result = fn()
+            except Exception as e:
+                self.finish(key, call, error=e)
+                raise
+            except BaseException:
+                self.cancel(key, call)
+                raise
+            self.finish(key, call, result=result)
+            return result
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._calls))
@@ -0,0 +1,82 @@
+import contextvars
+import json
+import queue
+import threading
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def iter_sse_deltas(lines):
+    # OpenAI-compatible chat completion stream: "data: {json}" events ending with "data: [DONE]"
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.startswith("data:"):
+            continue
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            return
+        event = json.loads(payload)
+        if "error" in event:
+            raise RuntimeError(f"Stream error: {event['error']}")
+        for choice in event.get("choices", []):
+            content = choice.get("delta", {}).get("content")
+            if content:
+                yield content
+
+
+def iter_section_lines(deltas, marker="### "):
+    # Yields (section_number, line) as soon as each line is complete; a marker starts a new section
+    section, buffer = 0, ""
+    for delta in deltas:
+        buffer += delta
+        while True:
+            newline = buffer.find("\n")
+            start = buffer.find(marker)
+            if start != -1 and (newline == -1 or start < newline):
+                if start:
+                    yield section, buffer[:start]
+                section += 1
+                buffer = buffer[start + len(marker):]
+            elif newline != -1:
+                yield section, buffer[:newline]
+                buffer = buffer[newline + 1:]
+            else:
+                break
+    if buffer:
+        yield section, buffer
+
+
+def iter_in_background(produce):
+    # Drains produce() on its own thread into a queue, so the producer (and anything it holds
+    # while iterating, like a rate-limit slot) never waits on a slow consumer
+    items = queue.SimpleQueue()
+    stop = threading.Event()
+
+    def pump():
+        try:
+            for item in produce():
+                if stop.is_set():
+                    break
+                items.put(item)
+        except Exception as e:
+            items.put(_Failure(e))
+        finally:
+            items.put(_DONE)
+
+    threading.Thread(target=contextvars.copy_context().run, args=(pump,), name="stream-reader", daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,201 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "stdout" or "stderr"; tools that print their own output to stdout switch logs to stderr
+LOG_STREAM = os.getenv("LOG_STREAM", "stdout").lower()
+# Fraction of requests whose verbose payloads (prompt text, reply preview) are logged
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+# Dump a per-request trace for every request, or for requests slower than TRACE_SLOW_MS
+TRACE_REQUESTS = os.getenv("TRACE_REQUESTS", "").lower() in ("1", "true", "yes")
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+logger = logging.getLogger("bot")
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def _setup_logging():
+    # Request threads only enqueue records; a listener thread does the stream writes
+    if logger.handlers:
+        return
+    records = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stderr if LOG_STREAM == "stderr" else sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(records, stream)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+
+_setup_logging()
+
+
+def log_event(event, level=logging.INFO, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+def sampled():
+    return random.random() < LOG_SAMPLE_RATE
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = self._values or ({(): 0} if not self.labelnames else {})
+            for values, count in sorted(series.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, values)} {count}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=STAGE_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labelvalues -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.setdefault(labelvalues, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, values)} {series[-2]}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, values)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    # Read at scrape time: callback() returns [(labelvalues, value), ...]; kind="counter"
+    # exposes cumulative stats kept elsewhere (cache, single-flight, connection pools)
+    def __init__(self, name, help, labelnames, callback, kind="gauge"):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.callback = callback
+        self.kind = kind
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, value in self.callback():
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {value}")
+        return lines
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        try:
+            lines += metric.render()
+        except Exception as e:
+            log_event("metric_render_failed", logging.WARNING, metric=metric.name, error=str(e))
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = register(Histogram("bot_stage_seconds", "Time spent per pipeline stage.", ("stage",)))
+UPSTREAM_ERRORS = register(Counter("bot_upstream_errors_total", "Failed or late upstream calls.", ("upstream", "reason")))
+TRUNCATIONS = register(Counter("bot_truncations_total", "Context trimmed to budget or replies split into parts.", ("kind",)))
+EMPTY_REPLIES = register(Counter("bot_empty_replies_total", "Requests that produced no deliverable script."))
+REQUESTS = register(Counter("bot_requests_total", "Incoming webhook requests.", ("mode",)))
+
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace["spans"].append({
+            "stage": stage,
+            "end_ms": round((time.perf_counter() - trace["start"]) * 1000, 2),
+            "duration_ms": round(seconds * 1000, 2),
+        })
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def trace_request(name, force=False, **attrs):
+    # Spans observed in this context (and in contexts copied from it) are collected and,
+    # when tracing is enabled for the request, dumped as one log line at the end
+    trace = {"start": time.perf_counter(), "spans": []}
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+        total_ms = (time.perf_counter() - trace["start"]) * 1000
+        if force or TRACE_REQUESTS or (TRACE_SLOW_MS and total_ms >= TRACE_SLOW_MS):
+            log_event("trace", name=name, total_ms=round(total_ms, 2), spans=trace["spans"], **attrs)
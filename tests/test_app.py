@@ -0,0 +1,193 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("twilio")
+pytest.importorskip("praw")
+
+import app  # noqa: E402
+import ratelimit  # noqa: E402
+from cache import TieredCache  # noqa: E402
+from singleflight import SingleFlight  # noqa: E402
+
+SCRIPT = "### 1. Instagram Reel Script\nA sharp claim.\n### 2. Twitter (X) Thread\n1/ A counterpoint.\n"
+
+
+class FlakyCache(TieredCache):
+    def __init__(self, fail_on):
+        super().__init__(db_path=None)
+        self.fail_on = set(fail_on)
+
+    def get(self, namespace, key):
+        if "get" in self.fail_on:
+            self.fail_on.discard("get")
+            raise RuntimeError("database is locked")
+        return super().get(namespace, key)
+
+    def set(self, namespace, key, value, ttl):
+        if "set" in self.fail_on:
+            self.fail_on.discard("set")
+            raise RuntimeError("database is locked")
+        super().set(namespace, key, value, ttl)
+
+
+class FakeCompletion:
+    # Stands in for _stream_completion; `unavailable` plays the context sources gather_sources missed
+    def __init__(self):
+        self.calls = []
+        self.unavailable = {}
+
+    def __call__(self, user_idea, missing=None):
+        self.calls.append(user_idea)
+        if missing is not None:
+            missing.update(self.unavailable)
+        yield from SCRIPT.splitlines(keepends=True)
+
+
+@pytest.fixture
+def generation(monkeypatch):
+    completion = FakeCompletion()
+    monkeypatch.setattr(app, "_stream_completion", completion)
+    monkeypatch.setattr(app, "script_flights", SingleFlight())
+    return completion
+
+
+def test_failed_cache_write_still_ends_the_flight(monkeypatch, generation):
+    monkeypatch.setattr(app, "cache", FlakyCache({"set"}))
+    assert app.generate_script("rust async") == SCRIPT
+    assert app.script_flights.stats()["in_flight"] == 0
+    assert app.generate_script("rust async") == SCRIPT
+    assert len(generation.calls) == 2  # the first result wasn't cached, so the idea is regenerated
+
+
+def test_failed_cache_read_still_ends_the_flight(monkeypatch, generation):
+    monkeypatch.setattr(app, "cache", FlakyCache({"get"}))
+    assert app.generate_script("rust async") == app.GENERATION_FAILED_REPLY
+    assert app.script_flights.stats() == {"leaders": 1, "coalesced": 0, "errors": 1, "cancelled": 0, "in_flight": 0}
+    assert app.generate_script("rust async") == SCRIPT
+
+
+def test_closing_the_stream_cancels_the_flight(monkeypatch, generation):
+    monkeypatch.setattr(app, "cache", TieredCache(db_path=None))
+    stream = app.stream_script("rust async")
+    next(stream)
+    stream.close()
+    assert app.script_flights.stats()["cancelled"] == 1
+    assert app.script_flights.stats()["in_flight"] == 0
+
+
+def test_partial_context_scripts_are_cached_briefly(monkeypatch, generation):
+    cache = TieredCache(db_path=None)
+    monkeypatch.setattr(app, "cache", cache)
+    generation.unavailable["brave"] = "timed out"
+    app.generate_script("rust async")
+    expires = cache._lookup("script", "rust async")[1]
+    assert expires - time.time() == pytest.approx(app.PARTIAL_SCRIPT_CACHE_TTL, abs=1)
+
+    generation.unavailable.clear()
+    app.generate_script("go generics")
+    expires = cache._lookup("script", "go generics")[1]
+    assert expires - time.time() == pytest.approx(app.SCRIPT_CACHE_TTL, abs=1)
+
+
+def test_partial_context_scripts_can_skip_the_cache(monkeypatch, generation):
+    monkeypatch.setattr(app, "cache", TieredCache(db_path=None))
+    monkeypatch.setattr(app, "PARTIAL_SCRIPT_CACHE_TTL", 0)
+    generation.unavailable["reddit"] = "rate limited (concurrency limit)"
+    app.generate_script("rust async")
+    assert app.cache.get("script", "rust async") is None
+
+
+def test_background_refresh_uses_the_partial_ttl(monkeypatch, generation):
+    cache = TieredCache(db_path=None, stale_ttl=300)
+    monkeypatch.setattr(app, "cache", cache)
+    cache.set("script", "rust async", "old script", -1)  # expired but still servable
+    generation.unavailable["brave"] = "timed out"
+    assert app.generate_script("rust async") == "old script"
+    deadline = time.monotonic() + 2
+    while cache.get("script", "rust async") is None:
+        assert time.monotonic() < deadline, "refresh never stored its result"
+        time.sleep(0.01)
+    expires = cache._lookup("script", "rust async")[1]
+    assert expires - time.time() == pytest.approx(app.PARTIAL_SCRIPT_CACHE_TTL, abs=1)
+
+
+class FakeStream:
+    def __init__(self, delay):
+        self.delay = delay
+        self.status_code = 200
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self):
+        time.sleep(self.delay)  # time to first token
+        yield 'data: {"choices": [{"delta": {"content": "hi"}}]}'
+        yield "data: [DONE]"
+
+
+def test_queue_wait_is_not_counted_as_groq_latency(monkeypatch):
+    monkeypatch.setenv("MAX_CONCURRENCY_GROQ", "1")
+    ratelimit.reset_limiters()
+    monkeypatch.setattr(app.http_client, "post", lambda *args, **kwargs: FakeStream(0.05))
+    marked = []
+    mark_latency = ratelimit.Slot.mark_latency
+    monkeypatch.setattr(ratelimit.Slot, "mark_latency", lambda slot, seconds: marked.append(seconds) or mark_latency(slot, seconds))
+    threads = [threading.Thread(target=lambda: list(app._groq_deltas("prompt"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    ratelimit.reset_limiters()
+    # Calls queued behind each other for up to ~0.15 s, but each one's TTFT was ~0.05 s
+    assert len(marked) == 4
+    assert max(marked) < 0.09
+
+
+def test_one_section_per_platform_is_sent():
+    text = (
+        "Intro\n"
+        "### 1. Instagram Reel Script\nHook line.\n"
+        "### 2. Twitter (X) Thread\n1/ First thread.\n"
+        "### Tweet 2 on X\nA second X section.\n"
+    )
+    deltas = [text[i:i + 7] for i in range(0, len(text), 7)]
+    assert list(app.stream_messages(deltas)) == [
+        "📸 *Instagram Reel (Part 1):*\n\n1. Instagram Reel Script\nHook line.",
+        "🐦 *X Thread (Part 1):*\n\n2. Twitter (X) Thread\n1/ First thread.",
+    ]
+
+
+def test_long_section_parts_are_numbered_in_order():
+    body = "\n".join(f"Beat {i}: " + "x" * 60 for i in range(6))
+    messages = list(app.stream_messages([f"### Instagram\n{body}\n"], max_length=200))
+    assert [message.split(":*")[0] for message in messages] == [
+        f"📸 *Instagram Reel (Part {n})" for n in range(1, len(messages) + 1)
+    ]
+    assert len(messages) > 1
+
+
+def test_groq_cooldown_still_answers_cached_ideas(monkeypatch, generation):
+    monkeypatch.setattr(app, "ASYNC_REPLIES", False)
+    monkeypatch.setattr(app, "cache", TieredCache(db_path=None))
+    monkeypatch.setattr(app, "admission", ratelimit.Admission(max_in_flight=10, max_per_sender=2))
+    ratelimit.reset_limiters()
+    app.cache.set("script", "rust async", SCRIPT, 60)
+    ratelimit.get_limiter("groq").concurrency.blocked_until = time.monotonic() + 30
+    client = app.app.test_client()
+    try:
+        cached = client.post("/whatsapp", data={"Body": "Rust async!", "From": "whatsapp:+1"}).get_data(as_text=True)
+        uncached = client.post("/whatsapp", data={"Body": "go generics", "From": "whatsapp:+2"}).get_data(as_text=True)
+    finally:
+        ratelimit.reset_limiters()
+    assert "Instagram Reel (Part 1)" in cached
+    assert app.REJECTED_REPLIES["overloaded"] in uncached
+    assert generation.calls == []
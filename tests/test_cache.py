@@ -0,0 +1,139 @@
+import threading
+import time
+
+import pytest
+
+import cache as cache_module
+from cache import TieredCache, normalize_key
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Big  News!", "big news"),
+    ("  AI agents?? ", "ai agents"),
+    ('"Remote work" — pros & cons...', "remote work pros & cons"),
+    ("*Vision Pro*", "vision pro"),
+    ("node...js", "node.js"),
+])
+def test_equivalent_phrasings_share_a_key(a, b):
+    assert normalize_key(a) == normalize_key(b)
+
+
+def test_punctuation_inside_words_is_kept():
+    keys = {normalize_key(topic) for topic in ["C++", "C#", "C", "F#", "node.js", "node js"]}
+    assert len(keys) == 6
+    assert normalize_key("Learning C++!") == "learning c++"
+    assert normalize_key("C#?") == "c#"
+
+
+def test_empty_input():
+    assert normalize_key(None) == ""
+    assert normalize_key(" ... ") == ""
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "time", clock)
+    return clock
+
+
+def test_lru_evicts_least_recently_used(clock):
+    cache = TieredCache(max_entries=2, db_path=None)
+    cache.set("ns", "a", 1, 60)
+    cache.set("ns", "b", 2, 60)
+    assert cache.get("ns", "a") == 1  # "a" is now the most recent
+    cache.set("ns", "c", 3, 60)
+    assert cache.get("ns", "b") is None
+    assert cache.get("ns", "a") == 1
+    assert cache.get("ns", "c") == 3
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TieredCache(db_path=None, stale_ttl=0)
+    cache.set("ns", "k", "v", 10)
+    clock.now += 9
+    assert cache.get("ns", "k") == "v"
+    clock.now += 2
+    assert cache.get("ns", "k") is None
+    assert cache.peek("ns", "k") is None
+
+
+def test_sqlite_tier_survives_a_new_instance(clock, tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    TieredCache(db_path=path).set("script", "rust async", {"text": "script"}, 60)
+    reopened = TieredCache(db_path=path)
+    assert reopened.get("script", "rust async") == {"text": "script"}
+    clock.now += 61
+    assert TieredCache(db_path=path).get("script", "rust async") is None
+
+
+def test_stale_entry_is_served_while_one_refresh_runs(clock):
+    cache = TieredCache(db_path=None, stale_ttl=30)
+    cache.set("ns", "k", "old", 10)
+    clock.now += 15
+    release = threading.Event()
+    calls = []
+
+    def refresh():
+        calls.append(1)
+        release.wait(2)
+        return "new"
+
+    assert cache.peek("ns", "k", refresh, 10) == "old"
+    assert cache.peek("ns", "k", refresh, 10) == "old"  # the refresh already running is reused
+    release.set()
+    deadline = time.monotonic() + 2
+    while cache.get("ns", "k") != "new":
+        assert time.monotonic() < deadline, "refresh never stored its result"
+        time.sleep(0.01)
+    assert calls == [1]
+
+
+def test_refresh_without_ttl_stores_nothing_itself(clock):
+    cache = TieredCache(db_path=None, stale_ttl=30)
+    cache.set("ns", "k", "old", 10)
+    clock.now += 15
+    done = threading.Event()
+    assert cache.peek("ns", "k", lambda: done.set() or "new") == "old"
+    assert done.wait(2)
+    time.sleep(0.05)
+    assert cache.peek("ns", "k") == "old"
+
+
+def test_stats_count_hits_stale_hits_and_misses(clock):
+    cache = TieredCache(db_path=None, stale_ttl=30)
+    assert cache.peek("ns", "k") is None
+    cache.set("ns", "k", "v", 10)
+    assert cache.peek("ns", "k") == "v"
+    clock.now += 15
+    assert cache.peek("ns", "k") == "v"
+    clock.now += 30
+    assert cache.peek("ns", "k") is None
+    assert cache.stats() == {"ns": {"hits": 1, "stale_hits": 1, "misses": 2}}
+
+
+def test_get_or_compute_caches_results_but_not_errors(clock):
+    cache = TieredCache(db_path=None)
+    with pytest.raises(IOError):
+        cache.get_or_compute("ns", "k", lambda: (_ for _ in ()).throw(IOError("down")), 60)
+    assert cache.get_or_compute("ns", "k", lambda: "v", 60) == "v"
+    assert cache.get_or_compute("ns", "k", lambda: "other", 60) == "v"
+
+
+def test_servable_matches_peek_without_counting(clock):
+    cache = TieredCache(db_path=None, stale_ttl=30)
+    assert not cache.servable("ns", "k")
+    cache.set("ns", "k", "v", 10)
+    clock.now += 15
+    assert cache.servable("ns", "k")  # stale but still servable
+    clock.now += 30
+    assert not cache.servable("ns", "k")
+    assert cache.stats() == {}
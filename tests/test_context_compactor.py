@@ -0,0 +1,65 @@
+from context_compactor import compact_sources, estimate_tokens, split_snippets
+
+
+def search_results(*snippets):
+    return "\n\n".join(f"Title: {title}\nSnippet: {text}\nURL: https://example.com/{i}" for i, (title, text) in enumerate(snippets))
+
+
+def test_estimate_tokens_is_about_four_characters():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+
+
+def test_split_snippets_by_block_or_sentence():
+    assert split_snippets("One. Two! Three?") == (["One.", "Two!", "Three?"], " ")
+    assert split_snippets("Title: a\nSnippet: b\n\nTitle: c\nSnippet: d") == (
+        ["Title: a\nSnippet: b", "Title: c\nSnippet: d"], "\n\n"
+    )
+
+
+def test_near_duplicate_snippets_across_sources_are_dropped():
+    results = {
+        "wikipedia": "Rust guarantees memory safety without a garbage collector. It was first released in 2015.",
+        "brave": search_results(("Rust", "Rust guarantees memory safety without a garbage collector")),
+    }
+    compacted, stats = compact_sources("rust memory safety", results)
+    assert stats["duplicates_dropped"] == 1
+    assert compacted["brave"] == ""
+    assert "garbage collector" in compacted["wikipedia"]
+
+
+def test_relevant_snippets_win_the_budget_and_keep_their_order():
+    filler = [f"Unrelated sentence number {i} mentions gardening and weather patterns." for i in range(6)]
+    text = " ".join(filler[:3] + ["Rust borrow checker rules prevent data races."] + filler[3:])
+    compacted, stats = compact_sources("rust borrow checker", {"wikipedia": text}, total_budget=30)
+    kept = compacted["wikipedia"]
+    assert "Rust borrow checker rules prevent data races." in kept
+    assert stats["tokens_after"] <= 30
+    assert stats["tokens_saved"] == stats["tokens_before"] - stats["tokens_after"]
+    # Selected snippets stay in source order
+    positions = [text.index(sentence) for sentence in split_snippets(kept)[0]]
+    assert positions == sorted(positions)
+
+
+def test_per_source_budget(monkeypatch):
+    monkeypatch.setenv("CONTEXT_TOKEN_BUDGET_REDDIT", "20")
+    posts = search_results(*[(f"Post {i}", f"Opinion {i} on rust adoption in large companies today") for i in range(8)])
+    compacted, _ = compact_sources("rust adoption", {"reddit": posts}, total_budget=1000)
+    assert estimate_tokens(compacted["reddit"]) <= 20
+    assert compacted["reddit"]
+
+
+def test_oversized_best_snippet_is_truncated_not_dropped():
+    text = "Rust " + "ownership " * 200 + "explained."
+    compacted, _ = compact_sources("rust ownership", {"wikipedia": text}, total_budget=25)
+    assert compacted["wikipedia"].startswith("Rust ownership")
+    assert compacted["wikipedia"].endswith(" ...")
+    assert estimate_tokens(compacted["wikipedia"]) <= 25
+
+
+def test_nothing_is_cut_under_budget():
+    results = {"wikipedia": "Short intro. Second fact.", "brave": search_results(("Title", "A snippet"))}
+    compacted, stats = compact_sources("anything", results)
+    assert compacted == results
+    assert stats["duplicates_dropped"] == 0
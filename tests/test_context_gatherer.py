@@ -0,0 +1,104 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("praw")
+
+import context_gatherer  # noqa: E402
+import ratelimit  # noqa: E402
+from cache import TieredCache  # noqa: E402
+from context_gatherer import format_context, gather_sources  # noqa: E402
+from singleflight import SingleFlight  # noqa: E402
+
+
+def answer(text, delay=0.0):
+    def fetch(topic):
+        time.sleep(delay)
+        return f"{text} about {topic}"
+    return fetch
+
+
+def fail(error):
+    def fetch(topic):
+        raise error
+    return fetch
+
+
+@pytest.fixture
+def sources(monkeypatch):
+    # Isolated registry, cache, flights, limiters and pool; tests register their own sources
+    registry = {}
+    monkeypatch.setattr(context_gatherer, "SOURCES", registry)
+    monkeypatch.setattr(context_gatherer, "cache", TieredCache(db_path=None))
+    monkeypatch.setattr(context_gatherer, "source_flights", SingleFlight())
+    ratelimit.reset_limiters()
+    executor = ThreadPoolExecutor(max_workers=8)
+    monkeypatch.setattr(context_gatherer, "_executor", executor)
+    yield registry
+    executor.shutdown(wait=False)
+    ratelimit.reset_limiters()
+
+
+def test_all_sources_answer(sources):
+    context_gatherer.register_source("wiki", "📚 Wiki", answer("summary"))
+    context_gatherer.register_source("news", "📰 News", answer("headlines"))
+    results, missing = gather_sources("rust")
+    assert results == {"wiki": "summary about rust", "news": "headlines about rust"}
+    assert missing == {}
+
+
+def test_slow_and_failing_sources_are_reported_missing(sources):
+    context_gatherer.register_source("wiki", "📚 Wiki", answer("summary"))
+    context_gatherer.register_source("slow", "🐢 Slow", answer("late", delay=1), timeout=0.1)
+    context_gatherer.register_source("broken", "💥 Broken", fail(IOError("503 from upstream")))
+    started = time.monotonic()
+    results, missing = gather_sources("rust", timeout=2)
+    assert time.monotonic() - started < 0.5  # only the slow source's own deadline was waited out
+    assert results == {"wiki": "summary about rust"}
+    assert missing == {"slow": "timed out", "broken": "error: 503 from upstream"}
+
+
+def test_rate_limited_source_is_reported_without_waiting(sources, monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_NEWS", "1")
+    context_gatherer.register_source("news", "📰 News", answer("headlines"))
+    assert gather_sources("rust")[1] == {}
+    started = time.monotonic()
+    results, missing = gather_sources("go")
+    assert time.monotonic() - started < 0.5
+    assert missing == {"news": "rate limited (rate limit)"}
+
+
+def test_overall_budget_bounds_the_fan_out(sources):
+    context_gatherer.register_source("slow", "🐢 Slow", answer("late", delay=1), timeout=5)
+    started = time.monotonic()
+    results, missing = gather_sources("rust", timeout=0.2)
+    assert time.monotonic() - started < 0.5
+    assert missing == {"slow": "timed out"}
+
+
+def test_source_deadline_starts_when_its_fetch_starts(sources, monkeypatch):
+    # One worker: the second source waits 0.15 s in the queue, then fetches within its own 0.25 s
+    monkeypatch.setattr(context_gatherer, "_executor", ThreadPoolExecutor(max_workers=1))
+    context_gatherer.register_source("first", "1️⃣ First", answer("one", delay=0.15), timeout=0.25)
+    context_gatherer.register_source("second", "2️⃣ Second", answer("two", delay=0.15), timeout=0.25)
+    results, missing = gather_sources("rust", timeout=2)
+    assert missing == {}
+    assert set(results) == {"first", "second"}
+
+
+def test_cached_source_is_not_fetched_again(sources):
+    calls = []
+    context_gatherer.register_source("wiki", "📚 Wiki", lambda topic: calls.append(topic) or "summary", ttl=60)
+    gather_sources("Rust!")
+    results, _ = gather_sources("rust")
+    assert results == {"wiki": "summary"}
+    assert calls == ["Rust!"]
+
+
+def test_format_context_marks_missing_sources_in_order(sources):
+    context_gatherer.register_source("wiki", "📚 Wiki", answer("summary"))
+    context_gatherer.register_source("news", "📰 News", answer("headlines"))
+    context = format_context({"wiki": "summary"}, {"news": "timed out"})
+    assert context.index("📚 Wiki:\nsummary") < context.index("📰 News:\n[Unavailable: timed out]")
+    assert context.endswith("⚠️ Missing sources: 📰 News\n")
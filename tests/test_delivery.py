@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pytest
+
+from bench.fake_upstreams import FakeTwilio, Profile
+from delivery import DeliveryPool, PermanentDeliveryError, TwilioRestSender
+
+
+class FakeSender:
+    # Fails the first `failures` sends of each body, then records it
+    def __init__(self, failures=0, error=IOError):
+        self.failures = failures
+        self.error = error
+        self.attempts = {}
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, to, from_, body):
+        with self._lock:
+            self.attempts[body] = self.attempts.get(body, 0) + 1
+            if self.attempts[body] <= self.failures:
+                raise self.error(f"send {body} failed")
+            self.sent.append((to, from_, body))
+
+
+def make_pool(sender, handler=lambda job: iter(job["parts"]), **kwargs):
+    kwargs.setdefault("retry_backoff", 0)
+    return DeliveryPool(handler, sender, **kwargs)
+
+
+def job(to, *parts):
+    return {"to": to, "from": "whatsapp:+14155238886", "parts": parts}
+
+
+def drain(pool, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while pool.queue.unfinished_tasks:
+        assert time.monotonic() < deadline, "delivery pool did not drain"
+        time.sleep(0.01)
+
+
+def test_every_part_is_sent_in_order():
+    sender = FakeSender()
+    pool = make_pool(sender, workers=1)
+    assert pool.submit(job("whatsapp:+1", "part 1", "part 2")) == "queued"
+    drain(pool)
+    assert [body for _, _, body in sender.sent] == ["part 1", "part 2"]
+    assert sender.sent[0][:2] == ("whatsapp:+1", "whatsapp:+14155238886")
+
+
+def test_transient_failures_are_retried():
+    sender = FakeSender(failures=2)
+    pool = make_pool(sender, max_attempts=3)
+    pool.submit(job("whatsapp:+1", "hello"))
+    drain(pool)
+    assert sender.attempts == {"hello": 3}
+    assert [body for _, _, body in sender.sent] == ["hello"]
+    assert not pool.dead_letters
+
+
+def test_exhausted_retries_go_to_dead_letters():
+    sender = FakeSender(failures=5)
+    pool = make_pool(sender, max_attempts=2)
+    pool.submit(job("whatsapp:+1", "hello"))
+    drain(pool)
+    assert sender.attempts == {"hello": 2}
+    assert [(letter["body"], letter["attempts"]) for letter in pool.dead_letters] == [("hello", 2)]
+
+
+def test_permanent_errors_are_not_retried():
+    sender = FakeSender(failures=1, error=PermanentDeliveryError)
+    pool = make_pool(sender, max_attempts=3)
+    pool.submit(job("whatsapp:+1", "hello"))
+    drain(pool)
+    assert sender.attempts == {"hello": 1}
+    assert len(pool.dead_letters) == 1
+
+
+def test_handler_failure_is_dead_lettered_and_worker_survives():
+    def handler(job):
+        if job["to"] == "whatsapp:+bad":
+            raise RuntimeError("generation blew up")
+        yield from job["parts"]
+
+    sender = FakeSender()
+    pool = make_pool(sender, handler, workers=1)
+    pool.submit(job("whatsapp:+bad"))
+    pool.submit(job("whatsapp:+1", "still delivered"))
+    drain(pool)
+    assert [letter["error"] for letter in pool.dead_letters] == ["generation blew up"]
+    assert [body for _, _, body in sender.sent] == ["still delivered"]
+
+
+def test_submit_sheds_busy_senders_and_overload():
+    release = threading.Event()
+
+    def handler(job):
+        release.wait(5)
+        yield from job["parts"]
+
+    pool = make_pool(FakeSender(), handler, workers=1, max_queue=2, max_per_sender=1)
+    pool.submit(job("whatsapp:+0", "occupies the worker"))
+    deadline = time.monotonic() + 2
+    while pool.depth():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert pool.submit(job("whatsapp:+1", "a")) == "queued"
+    assert pool.submit(job("whatsapp:+1", "b")) == "sender_busy"
+    assert pool.submit(job("whatsapp:+2", "c")) == "queued"
+    assert pool.submit(job("whatsapp:+3", "d")) == "overloaded"
+    release.set()
+    drain(pool)
+
+
+@pytest.fixture
+def fake_twilio():
+    twilio = FakeTwilio(Profile(median_ms=0)).start()
+    yield twilio
+    twilio.stop()
+
+
+def test_rest_sender_posts_to_twilio(fake_twilio):
+    sender = TwilioRestSender("ACtest", "token", api_base=fake_twilio.url)
+    sid = sender.send("whatsapp:+1", "whatsapp:+14155238886", "hello")
+    assert sid.startswith("SM")
+    assert [body for _, body in fake_twilio.deliveries["whatsapp:+1"]] == ["hello"]
+
+
+def test_rest_sender_treats_4xx_as_permanent(fake_twilio):
+    fake_twilio.profile.error_rate = 1.0
+    fake_twilio.profile.error_status = 400
+    sender = TwilioRestSender("ACtest", "token", api_base=fake_twilio.url)
+    with pytest.raises(PermanentDeliveryError):
+        sender.send("whatsapp:+1", "whatsapp:+14155238886", "hello")
+
+
+def test_pool_delivers_through_rest_sender(fake_twilio):
+    pool = make_pool(TwilioRestSender("ACtest", "token", api_base=fake_twilio.url))
+    for i in range(5):
+        pool.submit(job(f"whatsapp:+{i}", f"{i}: part 1", f"{i}: part 2"))
+    drain(pool)
+    assert not pool.dead_letters
+    for i in range(5):
+        bodies = [body for _, body in sorted(fake_twilio.deliveries[f"whatsapp:+{i}"])]
+        assert bodies == [f"{i}: part 1", f"{i}: part 2"]
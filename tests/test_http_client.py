@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+
+import http_client
+from bench.fake_upstreams import FakeUpstream, Profile
+
+
+@pytest.fixture
+def upstream():
+    fake = FakeUpstream("fake", Profile(median_ms=50, sigma=0))
+    fake.route("GET", r"/ping", lambda upstream, handler, match, query, body: handler.send_json(200, {"ok": True}))
+    yield fake.start()
+    fake.stop()
+
+
+@pytest.fixture
+def session_names(monkeypatch):
+    monkeypatch.setattr(http_client, "_sessions", {})
+    monkeypatch.setattr(http_client, "_pool_sizes", {})
+    monkeypatch.delenv("HTTP_POOL_SIZE", raising=False)
+    monkeypatch.setattr(http_client, "HTTP_POOL_SIZE", None)
+
+
+def concurrent_gets(name, url, count):
+    threads = [threading.Thread(target=lambda: http_client.get(name, url).raise_for_status()) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return next(iter(http_client.pool_stats()[name].values()))
+
+
+def test_pool_size_follows_upstream_concurrency(monkeypatch, session_names):
+    monkeypatch.setenv("MAX_CONCURRENCY_SEARCH", "12")
+    assert http_client._pool_size("search") == 12
+    http_client.set_pool_size("sms", 4)
+    assert http_client._pool_size("sms") == 4
+    monkeypatch.setenv("HTTP_POOL_SIZE_SMS", "2")
+    assert http_client._pool_size("sms") == 2
+
+
+def test_full_pool_discards_are_counted(upstream, session_names):
+    http_client.set_pool_size("small", 1)
+    stats = concurrent_gets("small", f"{upstream.url}/ping", 4)
+    assert stats["requests"] == 4
+    assert stats["discarded"] == stats["opened"] - 1
+    assert stats["idle"] == 1
+
+
+def test_pool_sized_for_concurrency_keeps_every_connection(upstream, session_names):
+    http_client.set_pool_size("sized", 4)
+    concurrent_gets("sized", f"{upstream.url}/ping", 4)
+    stats = concurrent_gets("sized", f"{upstream.url}/ping", 4)
+    assert stats["discarded"] == 0
+    assert stats["requests"] == 8
+    assert stats["reused"] >= 4
@@ -0,0 +1,187 @@
+import time
+
+import pytest
+
+import ratelimit
+from ratelimit import Admission, AdaptiveLimiter, FairQueue, RateLimited, TokenBucket, UpstreamLimiter
+
+
+@pytest.fixture(autouse=True)
+def fresh_limiters():
+    ratelimit.reset_limiters()
+    yield
+    ratelimit.reset_limiters()
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeHTTPError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.response = FakeResponse(status_code, headers)
+
+
+def test_token_bucket_spends_burst_then_refuses_without_sleeping():
+    bucket = TokenBucket(rate=1, burst=2)
+    assert bucket.acquire(0) and bucket.acquire(0)
+    started = time.monotonic()
+    assert not bucket.acquire(0.5)  # next token is ~1 s away
+    assert time.monotonic() - started < 0.1
+
+
+def test_token_bucket_waits_for_a_token_within_timeout():
+    bucket = TokenBucket(rate=20, burst=1)
+    assert bucket.acquire(0)
+    started = time.monotonic()
+    assert bucket.acquire(1)
+    assert 0.03 <= time.monotonic() - started < 0.5
+
+
+def test_token_bucket_refills_to_burst_only():
+    bucket = TokenBucket(rate=1000, burst=2)
+    time.sleep(0.02)
+    assert bucket.acquire(0) and bucket.acquire(0)
+    assert not bucket.acquire(0)
+
+
+def test_adaptive_limit_caps_in_flight():
+    limiter = AdaptiveLimiter(max_limit=2)
+    assert limiter.acquire(0) and limiter.acquire(0)
+    assert not limiter.acquire(0.05)
+    limiter.release(0.1)
+    assert limiter.acquire(0)
+
+
+def test_throttling_shrinks_limit_and_blocks_for_retry_after():
+    limiter = AdaptiveLimiter(max_limit=10)
+    assert limiter.acquire(0)
+    limiter.release(0.1, "throttled", retry_after=30)
+    assert limiter.limit == pytest.approx(7)
+    # Waiting can't outlast the Retry-After, so the caller is refused immediately
+    started = time.monotonic()
+    assert not limiter.acquire(1)
+    assert time.monotonic() - started < 0.1
+
+
+def test_failures_leave_baseline_and_limit_alone():
+    limiter = AdaptiveLimiter(max_limit=4)
+    assert limiter.acquire(0)
+    limiter.release(0.2)
+    limit = limiter.limit
+    for _ in range(5):
+        assert limiter.acquire(0)
+        limiter.release(0.001, "failed")
+    assert limiter.baseline == pytest.approx(0.2)
+    assert limiter.limit == limit
+
+
+def test_latency_spike_shrinks_limit():
+    limiter = AdaptiveLimiter(max_limit=10)
+    assert limiter.acquire(0)
+    limiter.release(0.1)
+    assert limiter.acquire(0)
+    limiter.release(0.1 * ratelimit.LATENCY_TOLERANCE * 2)
+    assert limiter.limit < 10
+
+
+def test_slot_turns_429_into_rate_limited():
+    upstream = UpstreamLimiter("fake", rate=0, burst=1, max_concurrency=4)
+    with pytest.raises(RateLimited) as caught:
+        with upstream.slot(0):
+            raise FakeHTTPError(429, {"Retry-After": "5"})
+    assert caught.value.reason == "throttled by upstream"
+    assert upstream.cooling_down()
+    assert upstream.concurrency.in_flight == 0
+
+
+def test_slot_passes_other_errors_through():
+    upstream = UpstreamLimiter("fake", rate=0, burst=1, max_concurrency=4)
+    with pytest.raises(FakeHTTPError):
+        with upstream.slot(0):
+            raise FakeHTTPError(500)
+    assert not upstream.cooling_down()
+    assert upstream.concurrency.in_flight == 0
+
+
+def test_slot_refuses_when_rate_limited_locally():
+    upstream = UpstreamLimiter("fake", rate=1, burst=1, max_concurrency=4)
+    with upstream.slot(0):
+        pass
+    with pytest.raises(RateLimited, match="rate limit"):
+        with upstream.slot(0):
+            pass
+
+
+def test_fair_queue_serves_keys_round_robin():
+    queue = FairQueue(maxsize=10, max_per_key=5, key=lambda item: item[0])
+    for item in ["a1", "a2", "a3", "b1", "c1", "b2"]:
+        assert queue.put_nowait(item) is None
+    assert [queue.get() for _ in range(6)] == ["a1", "b1", "c1", "a2", "b2", "a3"]
+
+
+def test_fair_queue_sheds_busy_keys_and_overload():
+    queue = FairQueue(maxsize=3, max_per_key=2, key=lambda item: item[0])
+    assert queue.put_nowait("a1") is None
+    assert queue.put_nowait("a2") is None
+    assert queue.put_nowait("a3") == "sender_busy"
+    assert queue.put_nowait("b1") is None
+    assert queue.put_nowait("c1") == "overloaded"
+    assert queue.qsize() == 3
+
+
+def test_fair_queue_tracks_unfinished_tasks():
+    queue = FairQueue(maxsize=5, max_per_key=5)
+    queue.put_nowait("x")
+    queue.put_nowait("y")
+    queue.get()
+    assert queue.unfinished_tasks == 2
+    queue.task_done()
+    assert queue.unfinished_tasks == 1
+
+
+def test_admission_caps_each_sender():
+    admission = Admission(max_in_flight=10, max_per_sender=2)
+    assert admission.try_enter("a") is None
+    assert admission.try_enter("a") is None
+    assert admission.try_enter("a") == "sender_busy"
+    assert admission.try_enter("b") is None
+    admission.leave("a")
+    assert admission.try_enter("a") is None
+
+
+def test_admission_caps_total_in_flight():
+    admission = Admission(max_in_flight=2, max_per_sender=2)
+    assert admission.try_enter("a") is None
+    assert admission.try_enter("b") is None
+    assert admission.try_enter("c") == "overloaded"
+
+
+def test_admit_releases_on_exit_and_when_body_raises():
+    admission = Admission(max_in_flight=1, max_per_sender=1)
+    with admission.admit("a") as rejected:
+        assert rejected is None
+        with admission.admit("b") as inner:
+            assert inner == "overloaded"
+    with pytest.raises(ValueError):
+        with admission.admit("a"):
+            raise ValueError()
+    assert admission.in_flight == 0
+    assert admission.per_sender == {}
+
+
+def test_admission_sheds_while_groq_cools_down():
+    admission = Admission(max_in_flight=10, max_per_sender=2)
+    ratelimit.get_limiter("groq").concurrency.blocked_until = time.monotonic() + 30
+    assert admission.try_enter("a") == "overloaded"
+
+
+def test_cooldown_does_not_shed_requests_that_skip_groq():
+    admission = Admission(max_in_flight=10, max_per_sender=2)
+    ratelimit.get_limiter("groq").concurrency.blocked_until = time.monotonic() + 30
+    assert admission.try_enter("a", needs_groq=False) is None
+    assert admission.try_enter("a", needs_groq=False) is None
+    assert admission.try_enter("a", needs_groq=False) == "sender_busy"
@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import FlightCancelled, SingleFlight
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.005)
+
+
+def run_waiters(flights, key, count, fn=lambda: "unused"):
+    outcomes = []
+    lock = threading.Lock()
+
+    def waiter():
+        try:
+            result = flights.do(key, fn, timeout=2)
+        except BaseException as e:
+            result = e
+        with lock:
+            outcomes.append(result)
+
+    threads = [threading.Thread(target=waiter) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: flights.stats()["coalesced"] >= count)
+    return threads, outcomes
+
+
+def test_leader_result_is_shared():
+    flights = SingleFlight()
+    call, leader = flights.begin("k")
+    assert leader
+    threads, outcomes = run_waiters(flights, "k", 3)
+    flights.finish("k", call, result="script")
+    for thread in threads:
+        thread.join(2)
+    assert outcomes == ["script"] * 3
+    assert flights.stats() == {"leaders": 1, "coalesced": 3, "errors": 0, "cancelled": 0, "in_flight": 0}
+
+
+def test_leader_error_fans_out_to_every_waiter():
+    flights = SingleFlight()
+    call, _ = flights.begin("k")
+    threads, outcomes = run_waiters(flights, "k", 3)
+    error = IOError("groq down")
+    flights.finish("k", call, error=error)
+    for thread in threads:
+        thread.join(2)
+    assert outcomes == [error] * 3
+    assert flights.stats()["errors"] == 1
+    # The failed flight is gone; the next caller leads a fresh one
+    assert flights.do("k", lambda: "recovered") == "recovered"
+
+
+def test_cancelled_leader_makes_waiters_retry():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def abandoned():
+        started.set()
+        release.wait(2)
+        raise GeneratorExit  # what a leader sees when its stream is closed early
+
+    leader = threading.Thread(target=lambda: pytest.raises(GeneratorExit, flights.do, "k", abandoned))
+    leader.start()
+    started.wait(2)
+    threads, outcomes = run_waiters(flights, "k", 2, fn=lambda: "retried")
+    release.set()
+    for thread in [leader] + threads:
+        thread.join(2)
+    # Neither waiter sees the cancellation; each retries and gets a real result
+    assert outcomes == ["retried"] * 2
+    stats = flights.stats()
+    assert stats["cancelled"] == 1
+    assert stats["errors"] == 0
+    assert stats["in_flight"] == 0
+
+
+def test_wait_on_cancelled_call_raises():
+    flights = SingleFlight()
+    call, _ = flights.begin("k")
+    flights.cancel("k", call)
+    with pytest.raises(FlightCancelled):
+        flights.wait(call, 0)
+
+
+def test_waiter_timeout_leaves_leader_running():
+    flights = SingleFlight()
+    call, _ = flights.begin("k")
+    waiting, leader = flights.begin("k")
+    assert not leader
+    with pytest.raises(TimeoutError):
+        flights.wait(waiting, 0.05)
+    assert flights.stats()["in_flight"] == 1
+
+    late, leader = flights.begin("k")
+    assert late is call and not leader
+    flights.finish("k", call, result="script")
+    assert flights.wait(late, 0) == "script"
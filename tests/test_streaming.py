@@ -0,0 +1,96 @@
+import json
+import threading
+
+import pytest
+
+from streaming import iter_in_background, iter_section_lines, iter_sse_deltas
+
+
+def sse(*contents):
+    for content in contents:
+        yield ("data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": content}}]})).encode()
+        yield b""
+
+
+def test_sse_deltas_skip_empty_and_non_data_lines():
+    lines = [": keep-alive", ""] + list(sse("Hel", "lo")) + [
+        "data: " + json.dumps({"choices": [{"index": 0, "delta": {"role": "assistant"}}]}),
+        "data: [DONE]",
+    ] + list(sse("after done"))
+    assert list(iter_sse_deltas(lines)) == ["Hel", "lo"]
+
+
+def test_sse_error_event_raises():
+    lines = list(sse("partial")) + ["data: " + json.dumps({"error": {"message": "overloaded"}})]
+    deltas = iter_sse_deltas(lines)
+    assert next(deltas) == "partial"
+    with pytest.raises(RuntimeError, match="overloaded"):
+        next(deltas)
+
+
+def test_section_lines_handle_markers_split_across_deltas():
+    deltas = ["Intro line\n#", "## 1. Instagram\nBeat one\nBeat", " two\n##", "# 2. Twitter\n1/ first"]
+    assert list(iter_section_lines(deltas)) == [
+        (0, "Intro line"),
+        (1, "1. Instagram"),
+        (1, "Beat one"),
+        (1, "Beat two"),
+        (2, "2. Twitter"),
+        (2, "1/ first"),
+    ]
+
+
+def test_section_marker_mid_line_starts_a_section():
+    assert list(iter_section_lines(["text ### 1. Reel\nbody"])) == [(0, "text "), (1, "1. Reel"), (1, "body")]
+
+
+def test_section_lines_match_whole_text():
+    text = "Preamble\n\n### 1. Reel\n\nA\nB\n\n### 2. Thread\n\nC\n"
+    chunked = [text[i:i + 3] for i in range(0, len(text), 3)]
+    assert list(iter_section_lines(chunked)) == list(iter_section_lines([text]))
+
+
+def test_background_iteration_propagates_items_and_errors():
+    def produce():
+        yield 1
+        yield 2
+        raise ValueError("stream broke")
+
+    items = iter_in_background(produce)
+    assert [next(items), next(items)] == [1, 2]
+    with pytest.raises(ValueError, match="stream broke"):
+        next(items)
+
+
+def test_background_producer_finishes_without_waiting_for_consumer():
+    finished = threading.Event()
+
+    def produce():
+        yield from range(5)
+        finished.set()
+
+    items = iter_in_background(produce)
+    assert next(items) == 0
+    # The consumer hasn't asked for more, but the producer (and whatever it holds) is done
+    assert finished.wait(2)
+    assert list(items) == [1, 2, 3, 4]
+
+
+def test_closing_consumer_stops_producer():
+    closed = threading.Event()
+    gate = threading.Event()
+
+    def produce():
+        try:
+            yield "first"
+            gate.wait(2)
+            while True:
+                yield "more"
+        finally:
+            closed.set()
+
+    items = iter_in_background(produce)
+    assert next(items) == "first"
+    items.close()
+    gate.set()
+    assert closed.wait(2)
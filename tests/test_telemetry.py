@@ -0,0 +1,98 @@
+import contextvars
+import json
+import logging
+import threading
+
+import pytest
+
+import telemetry
+from telemetry import Counter, Gauge, Histogram, JsonFormatter, observe_stage, span, trace_request
+
+
+@pytest.fixture
+def events(monkeypatch):
+    logged = []
+    monkeypatch.setattr(telemetry, "log_event", lambda event, level=logging.INFO, **fields: logged.append((event, fields)))
+    return logged
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("t_seconds", "Test.", ("stage",), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 2):
+        histogram.observe(value, "llm")
+    assert histogram.render() == [
+        "# HELP t_seconds Test.",
+        "# TYPE t_seconds histogram",
+        't_seconds_bucket{stage="llm",le="0.1"} 1',
+        't_seconds_bucket{stage="llm",le="1"} 2',
+        't_seconds_bucket{stage="llm",le="+Inf"} 3',
+        't_seconds_sum{stage="llm"} 2.55',
+        't_seconds_count{stage="llm"} 3',
+    ]
+
+
+def test_counter_renders_labels_and_zero_default():
+    counter = Counter("t_total", "Test.", ("upstream", "reason"))
+    counter.inc("brave", "timeout")
+    counter.inc("brave", "timeout", amount=2)
+    counter.inc("groq", 'quote " and\nnewline')
+    assert counter.render()[2:] == [
+        't_total{upstream="brave",reason="timeout"} 3',
+        't_total{upstream="groq",reason="quote \\" and\\nnewline"} 1',
+    ]
+    assert Counter("t_unlabelled_total", "Test.").render()[2:] == ["t_unlabelled_total 0"]
+
+
+def test_render_metrics_skips_a_failing_metric(monkeypatch, events):
+    def broken():
+        raise RuntimeError("stats unavailable")
+
+    counter = Counter("t_ok_total", "Test.")
+    monkeypatch.setattr(telemetry, "REGISTRY", [Gauge("t_broken", "Test.", (), broken), counter])
+    assert telemetry.render_metrics() == "# HELP t_ok_total Test.\n# TYPE t_ok_total counter\nt_ok_total 0\n"
+    assert events == [("metric_render_failed", {"metric": "t_broken", "error": "stats unavailable"})]
+
+
+def test_gauge_kind_sets_the_type_line():
+    gauge = Gauge("t_opened_total", "Test.", ("host",), lambda: [(("a",), 3)], kind="counter")
+    assert gauge.render() == ["# HELP t_opened_total Test.", "# TYPE t_opened_total counter", 't_opened_total{host="a"} 3']
+
+
+def test_trace_collects_spans_from_copied_contexts(events):
+    with trace_request("whatsapp", force=True, sender="whatsapp:+1") as trace:
+        with span("context"):
+            worker = threading.Thread(target=contextvars.copy_context().run, args=(observe_stage, "context.brave", 0.01))
+            worker.start()
+            worker.join()
+        observe_stage("llm_ttft", 0.2)
+    assert [s["stage"] for s in trace["spans"]] == ["context.brave", "context", "llm_ttft"]
+    assert len(events) == 1
+    event, fields = events[0]
+    assert event == "trace"
+    assert fields["name"] == "whatsapp" and fields["sender"] == "whatsapp:+1"
+    assert fields["spans"] is trace["spans"]
+
+
+def test_trace_is_only_logged_when_enabled(monkeypatch, events):
+    monkeypatch.setattr(telemetry, "TRACE_REQUESTS", False)
+    monkeypatch.setattr(telemetry, "TRACE_SLOW_MS", 0)
+    with trace_request("whatsapp"):
+        observe_stage("context", 0.01)
+    assert events == []
+    observe_stage("context", 0.01)  # outside a trace: histogram only
+
+
+def test_slow_requests_are_traced(monkeypatch, events):
+    monkeypatch.setattr(telemetry, "TRACE_SLOW_MS", 0.001)
+    with trace_request("delivery"):
+        observe_stage("context", 0.01)
+    assert [event for event, _ in events] == ["trace"]
+
+
+def test_json_formatter_flattens_fields():
+    record = logging.LogRecord("bot", logging.WARNING, __file__, 1, "context_missing", None, None)
+    record.fields = {"missing": {"brave": "timed out"}}
+    line = json.loads(JsonFormatter().format(record))
+    assert line["level"] == "warning"
+    assert line["event"] == "context_missing"
+    assert line["missing"] == {"brave": "timed out"}